@@ -0,0 +1,325 @@
+import json
+import os
+import re
+
+import numpy as np
+
+# Canonical analytes: key -> (display name, default unit)
+ANALYTES = {
+    "ph": ("pH", "pH units"),
+    "olsen_p": ("Olsen Phosphorus", "mg/L"),
+    "qt_k": ("Potassium", "MAF units"),
+    "qt_ca": ("Calcium", "MAF units"),
+    "qt_mg": ("Magnesium", "MAF units"),
+    "qt_na": ("Sodium", "MAF units"),
+    "k": ("Potassium", "me/100g"),
+    "ca": ("Calcium", "me/100g"),
+    "mg": ("Magnesium", "me/100g"),
+    "na": ("Sodium", "me/100g"),
+    "sulphate_s": ("Sulphate Sulphur", "mg/kg"),
+    "organic_s": ("Extractable Organic Sulphur", "mg/kg"),
+    "anaerobic_n": ("Anaerobically Mineralisable N", "kg/ha"),
+    "cec": ("CEC", "me/100g"),
+    "base_saturation": ("Total Base Saturation", "%"),
+    "organic_matter": ("Organic Matter", "%"),
+    "total_carbon": ("Total Carbon", "%"),
+    "total_nitrogen": ("Total Nitrogen", "%"),
+    "volume_weight": ("Volume Weight", "g/mL"),
+}
+
+# Name patterns, checked in order so the specific ones win (e.g. "Olsen P" before "P").
+# Derived values such as cation saturations and ratios map to None and are skipped.
+_ANALYTE_PATTERNS = [
+    ("base_saturation", r"base\s*sat"),
+    (None, r"saturation|ratio|retention|storage"),
+    ("cec", r"\bcec\b|cation\s*exchange"),
+    ("olsen_p", r"olsen|\bp\b|phosph"),
+    ("organic_s", r"organic\s*s(ulph|ulf|\b)"),
+    ("sulphate_s", r"sulph|sulf|\bso4\b|\bs\b"),
+    ("anaerobic_n", r"anaerobic|\bamn\b|mineralisable|mineralizable"),
+    ("organic_matter", r"organic\s*matter|\bom\b"),
+    ("total_carbon", r"total\s*carbon|\btc\b|organic\s*carbon"),
+    ("total_nitrogen", r"total\s*n(itrogen)?\b|\btn\b"),
+    ("volume_weight", r"volume\s*weight|bulk\s*density"),
+    ("ph", r"\bph\b"),
+    ("k", r"potassium|\bk\b"),
+    ("ca", r"calcium|\bca\b"),
+    ("mg", r"magnesium|\bmg\b"),
+    ("na", r"sodium|\bna\b"),
+]
+
+# Cations are reported either as MAF quick test (QT) values or as me/100g
+_QUICK_TEST = {"k": "qt_k", "ca": "qt_ca", "mg": "qt_mg", "na": "qt_na"}
+
+_UNITS = [
+    (r"me\s*/\s*100\s*g|cmol", "me/100g"),
+    (r"mg\s*/\s*l|ppm|µg/ml|ug/ml", "mg/L"),
+    (r"mg\s*/\s*kg", "mg/kg"),
+    (r"kg\s*/\s*ha", "kg/ha"),
+    (r"g\s*/\s*ml|g\s*/\s*cm", "g/mL"),
+    (r"maf|\bqt\b|quick\s*test", "MAF units"),
+    (r"%|percent", "%"),
+    (r"ph\s*units?", "pH units"),
+]
+
+# Medium ranges for pastoral soils, override with a JSON file through SOIL_REFERENCE_RANGES
+DEFAULT_REFERENCE_RANGES = {
+    "ph": (5.8, 6.3),
+    "olsen_p": (20, 30),
+    "qt_k": (5, 8),
+    "qt_ca": (4, 10),
+    "qt_mg": (8, 10),
+    "qt_na": (None, 10),
+    "k": (0.5, 0.8),
+    "ca": (6, 12),
+    "mg": (1, 3),
+    "na": (None, 0.5),
+    "sulphate_s": (10, 12),
+    "organic_s": (15, 20),
+    "anaerobic_n": (100, 200),
+    "cec": (12, 25),
+    "base_saturation": (50, 85),
+    "organic_matter": (7, 17),
+}
+
+
+def normalize_unit(text):
+    """
+    Map a unit as printed in a report to its canonical form.
+
+    Args:
+        text (str): Unit text, e.g. "me/100 g" or "MAF Units"
+
+    Returns:
+        str: Canonical unit, or None when the text is not a known unit
+    """
+    lowered = (text or "").strip().lower()
+    for pattern, unit in _UNITS:
+        if re.search(pattern, lowered):
+            return unit
+    return None
+
+
+def normalize_analyte(name, unit=None):
+    """
+    Map an analyte name as printed in a report to its canonical key.
+
+    Args:
+        name (str): Analyte name, may include the unit in brackets, e.g. "Olsen P (mg/L)"
+        unit (str): Unit from a separate column, if any
+
+    Returns:
+        tuple: (canonical key, canonical unit), the key is None when the name is not recognized
+    """
+    text = re.sub(r"\s+", " ", (name or "").replace("\n", " ")).strip()
+    bracketed = re.search(r"\(([^)]*)\)|\[([^\]]*)\]", text)
+    if unit is None and bracketed:
+        unit = bracketed.group(1) or bracketed.group(2)
+    label = re.sub(r"\(.*?\)|\[.*?\]", " ", text).lower()
+
+    key = next((candidate for candidate, pattern in _ANALYTE_PATTERNS if re.search(pattern, label)), None)
+    if key is None:
+        return None, None
+
+    canonical_unit = normalize_unit(unit) if unit else None
+    # Cations are quick test values unless reported in me/100g
+    if key in _QUICK_TEST and canonical_unit != "me/100g":
+        key = _QUICK_TEST[key]
+
+    return key, canonical_unit or ANALYTES[key][1]
+
+
+def parse_value(cell):
+    """
+    Parse a numeric cell such as "5.6", "< 0.5" or "12 (L)".
+
+    Returns:
+        float: The value, or NaN when the cell holds no number
+    """
+    match = re.search(r"-?\d+(?:\.\d+)?", str(cell or "").replace(",", ""))
+    return float(match.group()) if match else np.nan
+
+
+# Columns of an analytes-as-rows table that hold something other than a sample
+_NON_SAMPLE_COLUMN = re.compile(r"\bunits?\b|range|medium|optimum|target|method|level", re.IGNORECASE)
+
+
+def _clean(cell):
+    return re.sub(r"\s+", " ", str(cell or "")).strip()
+
+
+def _parse_table(table):
+    """Parse one extracted table into a samples x analytes DataFrame and a units dict."""
+    # pandas is imported on first use so importing this module stays cheap
+    import pandas as pd
+
+    rows = [[_clean(cell) for cell in row] for row in table if row and any(cell for cell in row)]
+    if len(rows) < 2:
+        return None, {}
+    header = rows[0]
+
+    # Samples as rows: the header row holds the analyte names
+    header_keys = [normalize_analyte(cell) for cell in header[1:]]
+    if sum(key is not None for key, _ in header_keys) >= 2:
+        body = rows[1:]
+        # An optional second header row with the units
+        if body and all(np.isnan(parse_value(cell)) or normalize_unit(cell) for cell in body[0][1:]) \
+                and any(normalize_unit(cell) for cell in body[0][1:]):
+            header_keys = [normalize_analyte(name, unit) if unit else normalize_analyte(name)
+                           for name, unit in zip(header[1:], body[0][1:])]
+            body = body[1:]
+        columns = [(index + 1, key, unit) for index, (key, unit) in enumerate(header_keys) if key is not None]
+        samples = [row[0] for row in body if row[0]]
+        values = [[parse_value(row[index]) if index < len(row) else np.nan for index, _, _ in columns]
+                  for row in body if row[0]]
+        frame = pd.DataFrame(values, index=samples, columns=[key for _, key, _ in columns], dtype=np.float64)
+        return frame, {key: unit for _, key, unit in columns}
+
+    # Analytes as rows: the first column holds the analyte names, the others one sample each
+    unit_column = next((index for index, cell in enumerate(header) if re.search(r"\bunits?\b", cell.lower())), None)
+    sample_columns = [index for index in range(1, len(header))
+                      if header[index] and not _NON_SAMPLE_COLUMN.search(header[index])]
+
+    records, units = {}, {}
+    for row in rows[1:]:
+        unit = row[unit_column] if unit_column is not None and unit_column < len(row) else None
+        key, canonical_unit = normalize_analyte(row[0], unit)
+        if key is None:
+            continue
+        records[key] = [parse_value(row[index]) if index < len(row) else np.nan for index in sample_columns]
+        units[key] = canonical_unit
+
+    if len(records) < 2 or not sample_columns:
+        return None, {}
+    frame = pd.DataFrame(records, index=[header[index] for index in sample_columns], dtype=np.float64)
+    return frame, units
+
+
+def parse_analyte_tables(tables):
+    """
+    Parse the tables extracted from a soil report into a typed per-sample table.
+
+    Tables may list samples as rows and analytes as columns or the other way
+    around. Unrecognized analytes are dropped and the values of a sample
+    spread over several tables are merged.
+
+    Args:
+        tables (list): Tables as lists of rows, as returned by pdfplumber
+
+    Returns:
+        pd.DataFrame: One row per sample, one float column per canonical analyte key,
+            with the units in ``attrs["units"]``. Empty when nothing was recognized.
+    """
+    import pandas as pd
+
+    combined = None
+    units = {}
+    order = []
+    for table in tables:
+        frame, table_units = _parse_table(table)
+        if frame is None or frame.empty:
+            continue
+        frame = frame.dropna(how="all")
+        frame = frame.loc[:, ~frame.columns.duplicated()]
+        frame = frame[~frame.index.duplicated()]
+        combined = frame if combined is None else combined.combine_first(frame)
+        order.extend(sample for sample in frame.index if sample not in order)
+        for key, unit in table_units.items():
+            units.setdefault(key, unit)
+
+    if combined is None:
+        combined = pd.DataFrame(dtype=np.float64)
+    else:
+        # combine_first sorts the samples, put them back in report order
+        combined = combined.reindex(order)
+    combined.index.name = "sample"
+    combined.attrs["units"] = units
+    return combined
+
+
+def load_reference_ranges(path=None):
+    """
+    Load the reference ranges used to flag analytes.
+
+    Args:
+        path (str): JSON file mapping analyte keys to [low, high], null for an open bound.
+            Defaults to SOIL_REFERENCE_RANGES, falling back to DEFAULT_REFERENCE_RANGES.
+
+    Returns:
+        dict: Analyte key -> (low, high)
+    """
+    ranges = dict(DEFAULT_REFERENCE_RANGES)
+    path = path or os.getenv("SOIL_REFERENCE_RANGES")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            ranges.update({key: tuple(bounds) for key, bounds in json.load(f).items()})
+    return ranges
+
+
+def flag_deviations(samples, ranges):
+    """
+    Compare every sample against the reference ranges.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from parse_analyte_tables
+        ranges (dict): Analyte key -> (low, high)
+
+    Returns:
+        pd.DataFrame: One row per out-of-range value with the columns
+            sample, analyte, value, unit, low, high and status ("low" or "high")
+    """
+    import pandas as pd
+
+    columns = [key for key in samples.columns if key in ranges]
+    empty = pd.DataFrame(columns=["sample", "analyte", "value", "unit", "low", "high", "status"])
+    if not columns or samples.empty:
+        return empty
+
+    values = samples[columns].to_numpy(dtype=np.float64)
+    low = np.array([np.nan if ranges[key][0] is None else ranges[key][0] for key in columns], dtype=np.float64)
+    high = np.array([np.nan if ranges[key][1] is None else ranges[key][1] for key in columns], dtype=np.float64)
+
+    # Comparisons against NaN are False, so missing values and open bounds are never flagged
+    is_low = values < low
+    is_high = values > high
+    sample_index, analyte_index = np.nonzero(is_low | is_high)
+    if len(sample_index) == 0:
+        return empty
+
+    units = samples.attrs.get("units", {})
+    keys = np.array(columns, dtype=object)[analyte_index]
+    return pd.DataFrame({
+        "sample": samples.index.to_numpy()[sample_index],
+        "analyte": keys,
+        "value": values[sample_index, analyte_index],
+        "unit": [units.get(key) or ANALYTES[key][1] for key in keys],
+        "low": low[analyte_index],
+        "high": high[analyte_index],
+        "status": np.where(is_low[sample_index, analyte_index], "low", "high"),
+    })
+
+
+def format_deviations(samples, deviations):
+    """
+    Format flagged values compactly for a prompt, grouped by sample.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from parse_analyte_tables
+        deviations (pd.DataFrame): Result of flag_deviations
+
+    Returns:
+        str: One line per sample listing its out-of-range analytes
+    """
+    lines = []
+    by_sample = {sample: group for sample, group in deviations.groupby("sample", sort=False)}
+    for sample in samples.index:
+        group = by_sample.get(sample)
+        if group is None:
+            lines.append(f"{sample}: all measured analytes within range")
+            continue
+        flags = []
+        for row in group.itertuples(index=False):
+            bounds = "-".join("" if np.isnan(bound) else f"{bound:g}" for bound in (row.low, row.high))
+            flags.append(f"{ANALYTES[row.analyte][0]} {row.value:g} {row.unit} {row.status.upper()} (range {bounds})")
+        lines.append(f"{sample}: " + "; ".join(flags))
+    return "\n".join(lines)
@@ -0,0 +1,379 @@
+"""
+Headless batch runner for directories of soil report PDFs.
+
+Usage:
+    python batch.py REPORTS_DIR --output results.jsonl [--workers 4] [--rpm 60] [--tpm 40000] [--farm NAME]
+
+Every report is extracted in a process pool, summarized and given
+fertilizer recommendations, and written to the output as one JSON line.
+Reports already in the output are skipped, so an interrupted run resumes
+where it stopped. Reports whose farm is known are also added to the report
+store, in batched transactions.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import openai
+
+import metrics
+import pipeline as core
+from analytes import parse_analyte_tables
+from cache import cache_key, hash_file, hash_text
+from extraction import assemble_report, extract_pages
+from store import detect_report_metadata
+
+
+class RateLimiter:
+    """
+    Token buckets for requests-per-minute and tokens-per-minute budgets.
+
+    Both buckets start full and refill continuously, so short bursts up to
+    the per-minute budget are allowed.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens):
+        """
+        Wait until one request of ``tokens`` tokens fits into both budgets.
+
+        Requests larger than the whole token budget wait for a full bucket.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        # The lock keeps waiters in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                )
+                await asyncio.sleep(max(wait, 0.01))
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Bounded scheduler for model requests.
+
+    Limits concurrency, paces requests against the rate limits and retries
+    429 and 5xx responses with exponential backoff and full jitter, honouring
+    Retry-After when the API sends it.
+
+    Attributes:
+        retries (int): Retries made so far
+        requests (int): Requests started so far
+    """
+
+    def __init__(self, concurrency, rate_limiter, max_retries=6, base_delay=1.0, max_delay=60.0,
+                 completion_tokens=800):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self.retries = 0
+        self.requests = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def run(self, request, prompt_tokens):
+        """
+        Run a request once it fits the budgets, retrying transient failures.
+
+        Args:
+            request (callable): Returns a new awaitable for every attempt
+            prompt_tokens (int): Estimated prompt tokens, the expected completion is added on top
+
+        Returns:
+            The request's result
+        """
+        async with self._slots:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire(prompt_tokens + self.completion_tokens)
+                self.requests += 1
+                try:
+                    return await request()
+                except Exception as e:
+                    if attempt == self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+
+
+def find_reports(directory, pattern="*.pdf", recursive=False):
+    """Return the PDF paths under a directory, sorted so runs are reproducible."""
+    if recursive:
+        pattern = os.path.join("**", pattern)
+    return sorted(glob.glob(os.path.join(directory, pattern), recursive=recursive))
+
+
+def load_checkpoint(output_path):
+    """
+    Read the results already written to the output file.
+
+    Returns:
+        set: (path, sha256) of the reports that completed successfully
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add((record["path"], record["sha256"]))
+    return done
+
+
+def _samples_to_dict(samples):
+    return {str(sample): {key: value for key, value in row.items() if not math.isnan(value)}
+            for sample, row in samples.to_dict(orient="index").items()}
+
+
+def _store_record(record, samples):
+    return {
+        "sha256": record["sha256"], "farm": record["farm"], "sampled_on": record["sampled_on"], "samples": samples,
+        "summary": record["summary"], "recommendations": record.get("recommendations"),
+        "source": os.path.basename(record["path"]),
+    }
+
+
+async def process_report(path, pdf_hash, pool, with_recommendations, farm=None):
+    """
+    Extract, summarize and recommend for one report.
+
+    Args:
+        path (str): PDF path
+        pdf_hash (str): SHA-256 of the PDF
+        pool (ProcessPoolExecutor): Extraction processes
+        with_recommendations (bool): Whether to generate recommendations
+        farm (str): Farm of the report, read from the report when None
+
+    Returns:
+        tuple: (JSON record written to the output, parsed samples or None on failure)
+    """
+    record = {"path": path, "sha256": pdf_hash, "status": "ok"}
+    samples = None
+    started = time.perf_counter()
+    try:
+        report_key = cache_key("report", pdf_hash, core.EXTRACTION_VERSION)
+        extracted = await core.get_cache().aget(report_key)
+        if extracted is None:
+            loop = asyncio.get_running_loop()
+            # Each worker process extracts a whole report, so no nested pools
+            with metrics.stage("extraction") as span:
+                pages = await loop.run_in_executor(pool, extract_pages, path)
+                # Recorded here, the worker's own metrics never reach this process
+                extracted = assemble_report(pages, span)
+            await core.get_cache().aset(report_key, extracted)
+
+        samples = parse_analyte_tables(extracted["tables"])
+        detected_farm, record["sampled_on"] = detect_report_metadata(extracted["content"])
+        record["farm"] = farm or detected_farm
+        record["samples"] = _samples_to_dict(samples)
+
+        summary_key = cache_key("summary", pdf_hash, core.MODEL, core.SUMMARY_PROMPT_VERSION,
+                                core.REFERENCE_RANGES_HASH)
+        summary = await core.get_cache().aget(summary_key)
+        if summary is None:
+            if samples.empty:
+                summary = await core.summarize_soil_report(extracted["content"])
+            else:
+                summary = await core.summarize_flagged_values(core.flagged_values(samples))
+            if summary.startswith("Error"):
+                raise RuntimeError(summary)
+            await core.get_cache().aset(summary_key, summary)
+        record["summary"] = summary
+
+        if with_recommendations:
+            plan = await asyncio.to_thread(core.fertilizer_plan, samples)
+            if plan is not None:
+                record["fertilizer_plan"] = plan.to_dict()
+                plan = plan.format()
+            recommendations_key = cache_key("recommendations", hash_text(summary), hash_text(plan or ""), core.MODEL,
+                                            core.RECOMMENDATION_PROMPT_VERSION)
+            recommendations = await core.get_cache().aget(recommendations_key)
+            if recommendations is None:
+                recommendations = await core.get_fertilizer_recommendations(summary, plan)
+                if recommendations.startswith("Error"):
+                    raise RuntimeError(recommendations)
+                await core.get_cache().aset(recommendations_key, recommendations)
+            record["recommendations"] = recommendations
+
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e) if isinstance(e, RuntimeError) else traceback.format_exc()
+        samples = None
+
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record, samples
+
+
+async def run_batch(paths, output_path, workers, concurrency, scheduler, with_recommendations=True, resume=True,
+                    farm=None, store=True, store_batch_size=50):
+    """
+    Process reports and append one JSON line per report to the output.
+
+    Args:
+        paths (list): PDF paths
+        output_path (str): JSONL output, also the checkpoint
+        workers (int): Extraction processes
+        concurrency (int): Reports in flight at once
+        scheduler (LLMScheduler): Scheduler for the model requests
+        with_recommendations (bool): Whether to generate recommendations
+        resume (bool): Skip reports already completed in the output
+        farm (str): Farm of every report, read from each report when None
+        store (bool): Add the reports of a known farm to the report store
+        store_batch_size (int): Reports written to the store per transaction, then checkpointed together
+
+    Returns:
+        dict: Counts of processed, skipped and failed reports
+    """
+    core.set_llm_scheduler(scheduler)
+    done = load_checkpoint(output_path) if resume else set()
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    reports = asyncio.Semaphore(concurrency)
+    pending = []
+
+    async def flush():
+        batch = pending[:]
+        pending.clear()
+        rows = [row for _, row in batch if row is not None]
+        if rows:
+            with metrics.stage("store_reports", reports=len(rows)):
+                await asyncio.to_thread(core.get_store().add_reports, rows, store_batch_size)
+        if batch:
+            # Checkpointed only once stored, so a resumed run redoes a report the store has not seen
+            output.writelines(line for line, _ in batch)
+            output.flush()
+            os.fsync(output.fileno())
+
+    # Spawned, not forked: by now this process has worker threads, maybe the metrics server and an open store
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    with pool, open(output_path, "a+", encoding="utf-8") as output:
+        # Terminate a line left incomplete by an interrupted run
+        if output.tell() > 0:
+            output.seek(output.tell() - 1)
+            if output.read(1) != "\n":
+                output.write("\n")
+
+        async def handle(path):
+            async with reports:
+                pdf_hash = await asyncio.to_thread(hash_file, path)
+                if (path, pdf_hash) in done:
+                    counts["skipped"] += 1
+                    return
+
+                record, samples = await process_report(path, pdf_hash, pool, with_recommendations, farm)
+                counts["processed" if record["status"] == "ok" else "failed"] += 1
+                print(f"[{record['status']}] {path} ({record['seconds']}s)", file=sys.stderr)
+
+                stored = store and record["status"] == "ok" and record["farm"]
+                pending.append((json.dumps(record) + "\n", _store_record(record, samples) if stored else None))
+                if len(pending) >= store_batch_size:
+                    await flush()
+
+        await asyncio.gather(*(handle(path) for path in paths))
+        await flush()
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a directory of soil report PDFs without the UI.")
+    parser.add_argument("directory", help="Directory with the soil report PDFs")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL output, also used to resume")
+    parser.add_argument("--pattern", default="*.pdf", help="File name pattern of the reports")
+    parser.add_argument("--recursive", action="store_true", help="Also look in subdirectories")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="Model requests in flight at once")
+    parser.add_argument("--rpm", type=int, default=60, help="Requests per minute budget")
+    parser.add_argument("--tpm", type=int, default=40000, help="Tokens per minute budget")
+    parser.add_argument("--max-retries", type=int, default=6, help="Retries per request on 429 and 5xx")
+    parser.add_argument("--no-recommendations", action="store_true", help="Only summarize the reports")
+    parser.add_argument("--restart", action="store_true", help="Ignore the results already in the output")
+    parser.add_argument("--farm", help="Farm of every report, read from each report by default")
+    parser.add_argument("--no-store", action="store_true", help="Do not add the reports to the report store")
+    args = parser.parse_args(argv)
+
+    paths = find_reports(args.directory, args.pattern, args.recursive)
+    if not paths:
+        parser.error(f"No reports matching {args.pattern} in {args.directory}")
+
+    metrics.start()
+
+    async def run():
+        scheduler = LLMScheduler(args.concurrency, RateLimiter(args.rpm, args.tpm), max_retries=args.max_retries)
+        counts = await run_batch(
+            paths,
+            args.output,
+            workers=args.workers,
+            concurrency=max(args.concurrency, args.workers),
+            scheduler=scheduler,
+            with_recommendations=not args.no_recommendations,
+            resume=not args.restart,
+            farm=args.farm,
+            store=not args.no_store
+        )
+        counts["requests"] = scheduler.requests
+        counts["retries"] = scheduler.retries
+        return counts
+
+    counts = asyncio.run(run())
+    print(json.dumps(counts), file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
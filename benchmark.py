@@ -0,0 +1,537 @@
+"""
+Benchmark harness for the soil report analyzer.
+
+Usage:
+    python benchmark.py [--sessions 8] [--pages 1,4,16] [--latency 0.5] [--tokens-per-second 50] [--warm-up]
+
+Generates synthetic soil report PDFs, starts a local stand-in for the chat
+completions API and drives process_pdf, process_query and
+process_recommendations under concurrent load. Reports p50/p95/p99 latency,
+time to first output, throughput, peak RSS (with the extraction workers) and token counts per stage
+without calling the real API. Startup is reported first: the import time of
+the modules in a fresh interpreter, building the UI, and the latency of the
+very first upload, optionally after warm-up.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Analytes written to the synthetic reports: (name, unit, low, high)
+SYNTHETIC_ANALYTES = [
+    ("pH", "pH Units", 4.8, 7.0),
+    ("Olsen Phosphorus", "mg/L", 8, 45),
+    ("Potassium", "MAF units", 2, 14),
+    ("Calcium", "MAF units", 3, 14),
+    ("Magnesium", "MAF units", 5, 30),
+    ("Sodium", "MAF units", 2, 12),
+    ("Sulphate Sulphur", "mg/kg", 3, 30),
+    ("CEC", "me/100g", 8, 30),
+    ("Total Base Saturation", "%", 35, 95),
+    ("Organic Matter", "%", 4, 20),
+]
+
+QUERIES = [
+    "What is the pH of sample 1?",
+    "Which samples need phosphorus and how much should I apply?",
+]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _text(x, y, text, size=9):
+    return f"BT /F1 {size} Tf {x:.1f} {y:.1f} Td ({_escape(text)}) Tj ET"
+
+
+def _table(x, y, rows, column_width, row_height=14):
+    """Draw a ruled table with its top left corner at (x, y), pdfplumber finds it from the lines."""
+    ops = ["0.5 w"]
+    columns = len(rows[0])
+    width = column_width * columns
+    height = row_height * len(rows)
+    for row in range(len(rows) + 1):
+        ops.append(f"{x:.1f} {y - row * row_height:.1f} m {x + width:.1f} {y - row * row_height:.1f} l S")
+    for column in range(columns + 1):
+        ops.append(f"{x + column * column_width:.1f} {y:.1f} m {x + column * column_width:.1f} {y - height:.1f} l S")
+    for row_index, row in enumerate(rows):
+        for column_index, cell in enumerate(row):
+            ops.append(_text(x + column_index * column_width + 3, y - (row_index + 1) * row_height + 4, str(cell), 7))
+    return ops, height
+
+
+def write_soil_report_pdf(path, pages=1, samples_per_table=4, tables_per_page=1, seed=0):
+    """
+    Write a synthetic soil report PDF.
+
+    Every page has some report text and ``tables_per_page`` ruled tables
+    listing the analytes as rows and ``samples_per_table`` samples as
+    columns, with values spread around the reference ranges.
+
+    Args:
+        path (str): Output path
+        pages (int): Number of pages
+        samples_per_table (int): Samples in each table
+        tables_per_page (int): Tables on each page
+        seed (int): Random seed, different seeds give different reports
+
+    Returns:
+        int: Total number of samples in the report
+    """
+    rng = random.Random(seed)
+    contents = []
+    sample = 0
+    for page in range(1, pages + 1):
+        ops = [
+            _text(50, 800, f"Soil Analysis Report {seed}", 14),
+            _text(50, 782, f"Client: Synthetic Farm {seed % 7}   Date Received: 2024-0{1 + seed % 9}-15   Page {page} of {pages}"),
+            _text(50, 768, "Method: MAF quick test. Results relate only to the samples as received."),
+        ]
+        y = 745
+        for _ in range(tables_per_page):
+            header = ["Analyte", "Units"] + [f"Sample {sample + index + 1}" for index in range(samples_per_table)]
+            rows = [header]
+            for name, unit, low, high in SYNTHETIC_ANALYTES:
+                values = [f"{rng.uniform(low, high):.1f}" for _ in range(samples_per_table)]
+                rows.append([name, unit] + values)
+            sample += samples_per_table
+            column_width = min(70, 495 / len(header))
+            table_ops, height = _table(50, y, rows, column_width)
+            ops.extend(table_ops)
+            y -= height + 30
+        contents.append("\n".join(ops).encode("latin-1"))
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and a content stream per page
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    kids = []
+    for index, content in enumerate(contents):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        kids.append(f"{page_id} 0 R")
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+        compressed = zlib.compress(content)
+        objects[content_id] = (f"<< /Length {len(compressed)} /Filter /FlateDecode >>\nstream\n".encode()
+                               + compressed + b"\nendstream")
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(f"{object_id} 0 obj\n".encode() + objects[object_id] + b"\nendobj\n")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for object_id in sorted(objects):
+            f.write(f"{offsets[object_id]:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+    return sample
+
+
+class FakeOpenAI:
+    """
+    Local stand-in for the chat completions API.
+
+    Answers POST /v1/chat/completions after ``latency`` seconds with
+    ``completion_tokens`` tokens of canned text, streamed at
+    ``tokens_per_second`` when the request asks for a stream.
+
+    Attributes:
+        requests (int): Requests served
+        prompt_tokens (int): Estimated prompt tokens received
+        completion_tokens_sent (int): Completion tokens sent
+    """
+
+    def __init__(self, latency=0.5, tokens_per_second=50.0, completion_tokens=200, port=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def counters(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens_sent,
+            }
+
+    def _record(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens_sent += completion_tokens
+
+    def _handler(self):
+        fake = self
+        words = ("The soil in this sample has low Olsen phosphorus and low potassium, the pH is slightly acidic "
+                 "and magnesium is adequate. Apply a potassic superphosphate and consider lime. ").split()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "".join(message.get("content") or "" for message in body.get("messages", []))
+                prompt_tokens = len(prompt) // 4 + 1
+                # Tag the text with the prompt's checksum so different reports get different summaries
+                tokens = [f"[{zlib.crc32(prompt.encode()):08x}] "]
+                tokens += [words[index % len(words)] + " " for index in range(fake.completion_tokens - 1)]
+                fake._record(prompt_tokens, len(tokens))
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                         "total_tokens": prompt_tokens + len(tokens)}
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                time.sleep(fake.latency)
+
+                if not body.get("stream"):
+                    payload = json.dumps({
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                        "model": body.get("model", "gpt-4"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(tokens)}}],
+                        "usage": usage,
+                    }).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(data):
+                    event = f"data: {data}\n\n".encode()
+                    self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(delta, finish_reason=None, chunk_usage=None):
+                    return json.dumps({
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body.get("model", "gpt-4"),
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                        "usage": chunk_usage,
+                    })
+
+                try:
+                    send(chunk({"role": "assistant", "content": ""}))
+                    for token in tokens:
+                        send(chunk({"content": token}))
+                        if fake.tokens_per_second:
+                            time.sleep(1 / fake.tokens_per_second)
+                    send(chunk({}, "stop"))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        send(chunk(None, chunk_usage=usage))
+                    send("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the stream
+                    pass
+
+        return Handler
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values using linear interpolation."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    """Peak resident set size over the life of this process and of its finished children, in MB."""
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor
+    return own, children
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process and its child processes, such as extraction workers, right now.
+
+    Returns:
+        float: MB, None where /proc is not available
+    """
+    try:
+        pids = {os.getpid()}
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids.update(int(pid) for pid in f.read().split())
+    except OSError:
+        return None
+
+    pages = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            # A worker that exited in the meantime
+            continue
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class RssSampler:
+    """
+    Peak RSS while a block runs, sampled from a background thread.
+
+    A thread keeps sampling while the event loop is busy with CPU bound work.
+    Where /proc is not available the peak falls back to the process peak so
+    far from peak_rss_mb, which also covers earlier stages.
+
+    Attributes:
+        peak_mb (float): Highest RSS seen, in MB
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb, rss)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        if self._sample() is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._thread is None:
+            self.peak_mb = peak_rss_mb()[0]
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+async def _timed(generator):
+    """Consume an async generator, returning (time to first output, total time, last output)."""
+    started = time.perf_counter()
+    first = None
+    last = None
+    async for last in generator:
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started, last
+
+
+async def run_stage(name, calls, fake):
+    """Run the calls of one stage concurrently and collect its statistics."""
+    before = fake.counters()
+    started = time.perf_counter()
+    with RssSampler() as rss:
+        results = await asyncio.gather(*(_timed(call()) for call in calls))
+    wall = time.perf_counter() - started
+    after = fake.counters()
+
+    first = [result[0] for result in results if result[0] is not None]
+    total = [result[1] for result in results]
+    stats = {
+        "stage": name,
+        "operations": len(calls),
+        "p50": percentile(total, 50),
+        "p95": percentile(total, 95),
+        "p99": percentile(total, 99),
+        "first_output_p50": percentile(first, 50),
+        "first_output_p95": percentile(first, 95),
+        "throughput": len(calls) / wall if wall else float("nan"),
+        "requests": after["requests"] - before["requests"],
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        "completion_tokens": after["completion_tokens"] - before["completion_tokens"],
+        "peak_rss_mb": rss.peak_mb,
+    }
+    return stats, [result[2] for result in results]
+
+
+async def run_benchmark(app, fake, pdf_paths):
+    """
+    Drive the three handlers for every PDF, one stage after the other.
+
+    Args:
+        app: The application module with process_pdf, process_query and process_recommendations
+        fake (FakeOpenAI): Running API stand-in
+        pdf_paths (list): One PDF per simulated session
+
+    Returns:
+        list: Statistics per stage
+    """
+    upload_stats, outputs = await run_stage(
+        "process_pdf", [lambda path=path: app.process_pdf(path) for path in pdf_paths], fake)
+    reports = [output[-1] for output in outputs if output is not None and output[-1] is not None]
+
+    query_stats, _ = await run_stage(
+        "process_query",
+        [lambda report=report, query=query: app.process_query(query, report) for report in reports for query in QUERIES],
+        fake)
+    recommendation_stats, _ = await run_stage(
+        "process_recommendations", [lambda report=report: app.process_recommendations(report) for report in reports],
+        fake)
+    return [upload_stats, query_stats, recommendation_stats]
+
+
+def measure_import(module):
+    """Seconds to import a module in a fresh interpreter, which is what a new instance pays."""
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+async def measure_startup(app, pipeline, pdf_path, warm_up=False):
+    """
+    Time building the UI and the first upload of a fresh process.
+
+    Returns:
+        dict: Seconds for each step
+    """
+    started = time.perf_counter()
+    app.create_app()
+    startup = {"create_app": time.perf_counter() - started}
+    if warm_up:
+        startup["warm_up"] = pipeline.warm_up()
+
+    first, total, _ = await _timed(app.process_pdf(pdf_path))
+    startup["first_request_first_output"] = first
+    startup["first_request"] = total
+    return startup
+
+
+def format_stats(rows):
+    """Format stage statistics as a plain text table."""
+    header = ["stage", "ops", "p50 s", "p95 s", "p99 s", "first p50 s", "ops/s", "requests", "prompt tok",
+              "completion tok", "stage peak RSS MB"]
+    lines = [" | ".join(header)]
+    for row in rows:
+        lines.append(" | ".join([
+            row["stage"], str(row["operations"]), f"{row['p50']:.3f}", f"{row['p95']:.3f}", f"{row['p99']:.3f}",
+            f"{row['first_output_p50']:.3f}", f"{row['throughput']:.2f}", str(row["requests"]),
+            str(row["prompt_tokens"]), str(row["completion_tokens"]), f"{row['peak_rss_mb']:.1f}",
+        ]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analyzer against a local API stand-in.")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent sessions per document size")
+    parser.add_argument("--pages", default="1,4,16", help="Comma separated page counts to benchmark")
+    parser.add_argument("--samples-per-table", type=int, default=4, help="Samples in each table")
+    parser.add_argument("--tables-per-page", type=int, default=1, help="Tables on each page")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the API stand-in answers")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Streaming speed, 0 for no delay")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens in every completion")
+    parser.add_argument("--warm-up", action="store_true", help="Warm the app up before the first request")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    fake = FakeOpenAI(args.latency, args.tokens_per_second, args.completion_tokens).start()
+    workdir = tempfile.mkdtemp(prefix="soil-bench-")
+
+    # Point the app at the stand-in, an empty cache and an empty store before it is imported
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["SOIL_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["SOIL_STORE_PATH"] = os.path.join(workdir, "reports.sqlite3")
+
+    startup = {module: measure_import(module) for module in ("pipeline", "test")}
+    started = time.perf_counter()
+    import pipeline
+    import test as app
+    startup["import"] = time.perf_counter() - started
+
+    async def run_all():
+        # One event loop for every size, the app's client and semaphores are bound to it
+        path = os.path.join(workdir, "report-startup.pdf")
+        write_soil_report_pdf(path, 1, args.samples_per_table, args.tables_per_page, seed=-1)
+        startup.update(await measure_startup(app, pipeline, path, args.warm_up))
+        print("Startup: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in startup.items()))
+
+        results = []
+        for pages in [int(value) for value in args.pages.split(",") if value.strip()]:
+            paths = []
+            for session in range(args.sessions):
+                path = os.path.join(workdir, f"report-{pages}p-{session}.pdf")
+                write_soil_report_pdf(path, pages, args.samples_per_table, args.tables_per_page,
+                                      seed=pages * 1000 + session)
+                paths.append(path)
+
+            rows = await run_benchmark(app, fake, paths)
+            for row in rows:
+                row["pages"] = pages
+            results.extend(rows)
+            print(f"\n{pages} page(s), {args.sessions} sessions")
+            print(format_stats(rows))
+        return results
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        fake.stop()
+
+    own, children = peak_rss_mb()
+    print(f"\nPeak RSS: {own:.1f} MB (child processes {children:.1f} MB)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"startup": startup, "stages": results, "peak_rss_mb": own, "children_peak_rss_mb": children},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
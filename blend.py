@@ -0,0 +1,337 @@
+import numpy as np
+
+from catalog import NUTRIENTS, get_catalog
+
+# Columns of every target and supply vector: the catalog nutrients plus lime (CaCO3 equivalent)
+COLUMNS = NUTRIENTS + ("lime",)
+
+# Analyte key -> (column, kg/ha needed to raise the test value by one unit). Rough
+# pastoral rules of thumb for the top 7.5 cm, the quick test keys come first so
+# they win over the me/100g values when a report has both.
+BUILDUP_FACTORS = {
+    "ph": ("lime", 10000.0),
+    "olsen_p": ("P", 7.0),
+    "qt_k": ("K", 60.0),
+    "qt_mg": ("Mg", 30.0),
+    "qt_ca": ("Ca", 400.0),
+    "k": ("K", 300.0),
+    "mg": ("Mg", 90.0),
+    "ca": ("Ca", 150.0),
+    "sulphate_s": ("S", 3.0),
+}
+
+# Supply of a column that is not needed, in kg/ha, that costs as much as missing a whole target
+INCIDENTAL_ALLOWANCE = {"lime": 1000.0}
+DEFAULT_INCIDENTAL_ALLOWANCE = 100.0
+EXCESS_ALLOWANCE = 10.0
+
+# Calcium carbonate equivalent of liming products that list no calcium or magnesium, such as aglime
+DEFAULT_LIME_EQUIVALENT = 0.9
+
+# Penalty per kg of product, favours fewer and smaller applications among equally good mixes
+RATE_PENALTY = 1e-5
+
+# Candidate mixes solved in one batch while cutting mixes to max_products, bounds memory
+MIX_BATCH_SIZE = 2048
+
+# Fit a cut mix may lose before swaps are tried, about 5% of one target, and the smallest relative gain a swap must bring
+SWAP_MISFIT = 1e-3
+SWAP_IMPROVEMENT = 1e-3
+
+
+def supply_matrix(catalog):
+    """
+    Nutrients supplied per kg of every product.
+
+    Args:
+        catalog (FertilizerCatalog): Product catalog
+
+    Returns:
+        np.ndarray: Columns x products, kg of each column per kg of product
+    """
+    supply = np.zeros((len(COLUMNS), len(catalog)))
+    supply[:len(NUTRIENTS)] = catalog.matrix.T / 100
+    # Carbonate content of the liming products from their Ca and Mg, other products do not lime
+    ca, mg = catalog.matrix[:, NUTRIENTS.index("Ca")], catalog.matrix[:, NUTRIENTS.index("Mg")]
+    equivalent = (ca / 40.08 + mg / 24.31) * 100.09 / 100
+    equivalent = np.where(equivalent > 0, equivalent, DEFAULT_LIME_EQUIVALENT)
+    supply[-1] = np.where(catalog._liming, equivalent, 0.0)
+    return supply
+
+
+def nutrient_targets(samples, ranges, buildup=None):
+    """
+    Work out how much of every column each sample needs, and what it has too much of.
+
+    A value below its reference range needs enough of the nutrient to bring
+    it up to the low bound. A value above its range marks the column as excess.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from analytes.parse_analyte_tables
+        ranges (dict): Analyte key -> (low, high)
+        buildup (dict): Analyte key -> (column, kg/ha per unit), BUILDUP_FACTORS by default
+
+    Returns:
+        tuple: (targets, excess), samples x columns arrays of kg/ha and booleans
+    """
+    buildup = BUILDUP_FACTORS if buildup is None else buildup
+    targets = np.zeros((len(samples.index), len(COLUMNS)))
+    excess = np.zeros(targets.shape, dtype=bool)
+    covered = np.zeros(targets.shape, dtype=bool)
+
+    for key, (column, factor) in buildup.items():
+        if key not in samples.columns or key not in ranges:
+            continue
+        index = COLUMNS.index(column)
+        values = samples[key].to_numpy(dtype=np.float64)
+        measured = ~np.isnan(values) & ~covered[:, index]
+        low, high = ranges[key]
+        if low is not None:
+            targets[:, index] = np.where(measured, np.maximum(low - values, 0) * factor, targets[:, index])
+        if high is not None:
+            excess[:, index] |= measured & (values > high)
+        covered[:, index] |= measured
+
+    return targets, excess
+
+
+def _allowed_products(catalog, excess, excess_tolerance):
+    # samples x products, False for products rich in a column the sample has too much of
+    nutrient_excess = excess[:, :len(NUTRIENTS)].astype(np.float64)
+    too_rich = nutrient_excess @ (catalog.matrix > excess_tolerance).T.astype(np.float64) > 0
+    too_rich |= excess[:, -1:] & catalog._liming[np.newaxis, :]
+    return ~too_rich
+
+
+def _weights(targets, excess):
+    allowance = np.array([INCIDENTAL_ALLOWANCE.get(column, DEFAULT_INCIDENTAL_ALLOWANCE) for column in COLUMNS])
+    weights = np.where(targets > 0, 1 / np.maximum(targets, 1e-9), 1 / allowance)
+    # Lime brings its calcium and magnesium along, that is not counted against it
+    liming = (targets[:, -1:] > 0) & np.isin(COLUMNS, ("Ca", "Mg"))[np.newaxis, :]
+    weights = np.where(liming & (targets <= 0), 0.0, weights)
+    return np.where(excess, 1 / EXCESS_ALLOWANCE, weights)
+
+
+def solve_rates(targets, weights, supply, allowed, iterations=3000, tolerance=1e-3, rate_penalty=RATE_PENALTY):
+    """
+    Solve the product rates of every sample in one batched projected gradient run.
+
+    Minimizes ``0.5 * ||w * (supply @ x - target)||^2 + rate_penalty * sum(x)``
+    for every sample with ``x >= 0`` and ``x = 0`` for the products it may not
+    use, using accelerated projected gradient (FISTA) with a diagonal
+    preconditioner, since targets range from a few kg of sulphur to tonnes of lime.
+
+    Args:
+        targets (np.ndarray): Samples x columns, kg/ha
+        weights (np.ndarray): Samples x columns, scale of every residual
+        supply (np.ndarray): Columns x products, from supply_matrix
+        allowed (np.ndarray): Samples x products booleans
+        iterations (int): Most gradient steps
+        tolerance (float): Stop once no rate moves by more than this many kg/ha in a step
+        rate_penalty (float): Cost per kg of product
+
+    Returns:
+        np.ndarray: Samples x products, kg/ha
+    """
+    weighted = weights[:, :, np.newaxis] * supply[np.newaxis, :, :]
+    # Jacobi scaling from the diagonal of every sample's normal matrix
+    scale = np.where(allowed, 1 / np.maximum((weighted ** 2).sum(axis=1), 1e-12), 0.0)
+    # The largest eigenvalue of the scaled normal matrix, from its small columns x columns counterpart
+    gram = (weighted * scale[:, np.newaxis, :]) @ weighted.transpose(0, 2, 1)
+    step = scale / np.maximum(np.linalg.eigvalsh(gram)[:, -1:], 1e-12)
+
+    rates = np.zeros(allowed.shape)
+    momentum = rates.copy()
+    t = 1.0
+    for _ in range(iterations):
+        residual = (momentum @ supply.T - targets) * weights
+        gradient = (residual * weights) @ supply + rate_penalty
+        updated = np.maximum(momentum - step * gradient, 0)
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        change = updated - rates
+        momentum = updated + ((t - 1) / t_next) * change
+        rates, t = updated, t_next
+        if np.abs(change).max(initial=0) < tolerance:
+            break
+    return rates
+
+
+def _misfit(rates, targets, weights, supply):
+    # Per sample weighted residual, the rate penalty only breaks ties inside solve_rates
+    residual = (rates @ supply.T - targets) * weights
+    return 0.5 * (residual ** 2).sum(axis=1)
+
+
+def _solve_mixes(targets, weights, supply, rows, mixes):
+    # Rates and objective of every candidate mix, rows maps each mix to its sample
+    rates = np.zeros(mixes.shape)
+    for start in range(0, len(rows), MIX_BATCH_SIZE):
+        batch = slice(start, start + MIX_BATCH_SIZE)
+        rates[batch] = solve_rates(targets[rows[batch]], weights[rows[batch]], supply, mixes[batch])
+    return rates, _misfit(rates, targets[rows], weights[rows], supply)
+
+
+def limit_products(targets, weights, supply, allowed, max_products, swap_rounds=3):
+    """
+    Solve the product rates of every sample using at most ``max_products`` products each.
+
+    Products are judged by how well the mix fits the weighted targets without
+    them, not by their rate, so a few kg of the only sulphur source outrank
+    tonnes of a lime another product can stand in for. Each round drops, from
+    every mix that is too long, the product whose removal costs least once the
+    rest are solved again. Mixes that lost a noticeable part of the fit then try
+    single swaps with every other allowed product while they improve it.
+
+    Args:
+        targets (np.ndarray): Samples x columns, kg/ha
+        weights (np.ndarray): Samples x columns, scale of every residual
+        supply (np.ndarray): Columns x products, from supply_matrix
+        allowed (np.ndarray): Samples x products booleans
+        max_products (int): Most products in one sample's mix
+        swap_rounds (int): Most rounds of swaps
+
+    Returns:
+        np.ndarray: Samples x products, kg/ha
+    """
+    rates = solve_rates(targets, weights, supply, allowed)
+    chosen = allowed & (rates > 0)
+    if not (chosen.sum(axis=1) > max_products).any():
+        return rates
+    uncapped = _misfit(rates, targets, weights, supply)
+    cost = uncapped.copy()
+
+    while (over := np.flatnonzero(chosen.sum(axis=1) > max_products)).size:
+        rows, mixes = [], []
+        for sample in over:
+            for product in np.flatnonzero(chosen[sample]):
+                mix = chosen[sample].copy()
+                mix[product] = False
+                rows.append(sample)
+                mixes.append(mix)
+        rows, mixes = np.array(rows), np.array(mixes)
+        mix_rates, mix_cost = _solve_mixes(targets, weights, supply, rows, mixes)
+        for sample in over:
+            candidates = np.flatnonzero(rows == sample)
+            best = candidates[np.argmin(mix_cost[candidates])]
+            chosen[sample], rates[sample], cost[sample] = mixes[best], mix_rates[best], mix_cost[best]
+
+    pending = np.flatnonzero(cost - uncapped > SWAP_MISFIT)
+    for _ in range(swap_rounds):
+        rows, mixes = [], []
+        for sample in pending:
+            inside, outside = np.flatnonzero(chosen[sample]), np.flatnonzero(allowed[sample] & ~chosen[sample])
+            swaps = np.repeat(chosen[sample][np.newaxis, :], len(inside) * len(outside), axis=0)
+            swaps[np.arange(len(swaps)), np.repeat(inside, len(outside))] = False
+            swaps[np.arange(len(swaps)), np.tile(outside, len(inside))] = True
+            rows.extend([sample] * len(swaps))
+            mixes.append(swaps)
+        if not rows:
+            break
+        rows, mixes = np.array(rows), np.concatenate(mixes)
+        mix_rates, mix_cost = _solve_mixes(targets, weights, supply, rows, mixes)
+        improved = []
+        for sample in pending:
+            candidates = np.flatnonzero(rows == sample)
+            best = candidates[np.argmin(mix_cost[candidates])]
+            if mix_cost[best] < cost[sample] * (1 - SWAP_IMPROVEMENT):
+                chosen[sample], rates[sample], cost[sample] = mixes[best], mix_rates[best], mix_cost[best]
+                improved.append(sample)
+        pending = improved
+    return rates
+
+
+class BlendPlan:
+    """
+    Product rates worked out for every sample of a report.
+
+    Attributes:
+        samples (list): Sample names
+        names (np.ndarray): Product names, in catalog order
+        rates (np.ndarray): Samples x products, kg/ha
+        targets (np.ndarray): Samples x COLUMNS, kg/ha needed
+        supplied (np.ndarray): Samples x COLUMNS, kg/ha the rates supply
+        excess (np.ndarray): Samples x COLUMNS, True where the soil has too much
+    """
+
+    def __init__(self, samples, names, rates, targets, supplied, excess):
+        self.samples = list(samples)
+        self.names = names
+        self.rates = rates
+        self.targets = targets
+        self.supplied = supplied
+        self.excess = excess
+
+    def to_dict(self):
+        """Return {sample: {product: kg/ha}} for the products that are applied."""
+        return {str(sample): {self.names[product]: float(self.rates[row, product])
+                              for product in np.flatnonzero(self.rates[row])}
+                for row, sample in enumerate(self.samples)}
+
+    def format(self):
+        """
+        Format the plan for the user and the prompt.
+
+        Returns:
+            str: Products and rates per sample, followed by what they supply against the targets
+        """
+        lines = []
+        for row, sample in enumerate(self.samples):
+            applied = np.flatnonzero(self.rates[row])
+            needed = np.flatnonzero(self.targets[row] > 0)
+            too_high = [COLUMNS[index] for index in np.flatnonzero(self.excess[row])]
+            if len(needed) == 0:
+                lines.append(f"{sample}: no nutrient deficits, no fertilizer needed")
+            elif len(applied) == 0:
+                lines.append(f"{sample}: no suitable product in the catalog")
+            else:
+                applied = applied[np.argsort(-self.rates[row, applied], kind="stable")]
+                products = ", ".join(f"{self.names[product]} {self.rates[row, product]:g} kg/ha" for product in applied)
+                lines.append(f"{sample}: {products}")
+            if len(needed):
+                lines.append("  supplies " + ", ".join(
+                    f"{COLUMNS[index]} {self.supplied[row, index]:.0f} of {self.targets[row, index]:.0f} kg/ha"
+                    for index in needed))
+            incidental = np.flatnonzero((self.targets[row] <= 0) & (self.supplied[row] >= 1))
+            if len(incidental):
+                lines.append("  also adds " + ", ".join(
+                    f"{COLUMNS[index]} {self.supplied[row, index]:.0f} kg/ha" for index in incidental))
+            if too_high:
+                lines.append("  avoids products rich in " + ", ".join(too_high))
+        return "\n".join(lines)
+
+
+def plan_blends(samples, ranges, catalog=None, max_products=4, min_rate=10.0, excess_tolerance=1.0,
+                rate_step=5.0):
+    """
+    Work out product mixes and application rates for every sample of a report.
+
+    All samples are solved together. Mixes are cut to ``max_products`` by
+    limit_products, products below ``min_rate`` are dropped and the rest solved
+    again, so every mix stays short enough to spread.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from analytes.parse_analyte_tables
+        ranges (dict): Analyte key -> (low, high)
+        catalog (FertilizerCatalog): Product catalog, the shared catalog by default
+        max_products (int): Most products in one sample's mix
+        min_rate (float): Smallest rate worth applying, kg/ha
+        excess_tolerance (float): Highest allowed percentage of an excess nutrient in a product
+        rate_step (float): Rates are rounded to multiples of this, kg/ha
+
+    Returns:
+        BlendPlan: Rates per sample
+    """
+    catalog = catalog or get_catalog()
+    supply = supply_matrix(catalog)
+    targets, excess = nutrient_targets(samples, ranges)
+    weights = _weights(targets, excess)
+    # Samples without deficits get nothing
+    allowed = _allowed_products(catalog, excess, excess_tolerance) & (targets > 0).any(axis=1, keepdims=True)
+
+    rates = limit_products(targets, weights, supply, allowed, max_products)
+    allowed &= rates >= min_rate
+    rates = solve_rates(targets, weights, supply, allowed)
+
+    rates = np.round(rates / rate_step) * rate_step
+    rates[rates < min_rate] = 0.0
+    return BlendPlan(samples.index, catalog.names, rates, targets, rates @ supply.T, excess)
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "soil-assistant")
+
+
+def cache_key(*parts):
+    """
+    Build a cache key from its parts.
+
+    Args:
+        *parts: Anything that identifies the result, e.g. the PDF hash, model and prompt version
+
+    Returns:
+        str: SHA-256 hex digest of the parts
+    """
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of some bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks so large files are never held in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    """Return the SHA-256 hex digest of a string."""
+    return hash_bytes(text.encode("utf-8"))
+
+
+# Returned by _get_memory when the key is not in memory
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Two-level cache of JSON-serializable results.
+
+    Lookups go to an in-memory LRU first and then to an on-disk store with
+    one file per key. Both levels are bounded in size, measured by the JSON
+    size of the entries, and evict the least recently used entries once they
+    grow past ``max_memory_bytes`` and ``max_disk_bytes``. The size of the
+    disk store is tracked as entries are written, the directory is only
+    scanned once when the cache is created.
+
+    Coroutines use aget and aset, which keep the disk reads, the writes and
+    the serialization off the event loop.
+
+    Attributes:
+        hits (int): Lookups answered from memory or disk
+        misses (int): Lookups that found nothing
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_memory_entries=256, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        # key -> (value, JSON size), least recently used first
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # key -> file size, least recently used first
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Key built with cache_key
+
+        Returns:
+            The cached value, or None when the key is not cached
+        """
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        return self._get_disk(key)
+
+    def set(self, key, value):
+        """
+        Store a result in memory and on disk.
+
+        Args:
+            key (str): Key built with cache_key
+            value: JSON-serializable result
+        """
+        try:
+            data = json.dumps(value).encode("utf-8")
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._remember(key, value, len(data))
+        self._write_disk(key, data)
+
+    async def aget(self, key):
+        """Look up a cached result from a coroutine, memory hits are answered without leaving the event loop."""
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        return await asyncio.to_thread(self._get_disk, key)
+
+    async def aset(self, key, value):
+        """Store a result from a coroutine, serializing and writing it in a worker thread."""
+        await asyncio.to_thread(self.set, key, value)
+
+    def stats(self):
+        """Return the hit/miss counters and the current cache sizes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def clear(self):
+        """Drop every entry from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for key in self._disk:
+                self._unlink(self._path(key))
+            self._disk.clear()
+            self._disk_bytes = 0
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return _MISSING
+            self._memory.move_to_end(key)
+            self.hits += 1
+            self.memory_hits += 1
+            return entry[0]
+
+    def _get_disk(self, key):
+        value, size = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                # Removed by another process sharing the directory
+                self._disk_bytes -= self._disk.pop(key, 0)
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, value, size)
+            self._track_disk(key, size)
+        return value
+
+    def _remember(self, key, value, size):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        # An entry larger than the whole memory budget stays on disk only
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_memory_entries or self._memory_bytes > self.max_memory_bytes:
+            self._memory_bytes -= self._memory.popitem(last=False)[1][1]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_disk_index(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        except OSError:
+            return
+        # Oldest first, file times carry the recency over from earlier runs
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _track_disk(self, key, size):
+        self._disk_bytes += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None, 0
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            value = json.loads(data)
+            # Touch the file so the next run sees it as recently used
+            os.utime(path)
+            return value, len(data)
+        except (OSError, ValueError):
+            return None, 0
+
+    def _write_disk(self, key, data):
+        if not self.directory:
+            return
+        temp_path = None
+        try:
+            # Write to a temp file first so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if temp_path is not None:
+                self._unlink(temp_path)
+            return
+
+        with self._lock:
+            self._track_disk(key, len(data))
+            while self._disk_bytes > self.max_disk_bytes and self._disk:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._unlink(self._path(evicted))
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
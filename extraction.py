@@ -0,0 +1,314 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from typing import NamedTuple
+
+import metrics
+
+# Number of extraction processes, 1 keeps extraction in the calling process
+DEFAULT_WORKERS = int(os.getenv("SOIL_EXTRACT_WORKERS", "1"))
+
+# Pages handed to a worker at a time, each worker opens the PDF once per batch
+PAGES_PER_TASK = 4
+
+# Documents with more pages than this are rejected before extraction starts, 0 for no limit
+MAX_PAGES = int(os.getenv("SOIL_MAX_PAGES", "200"))
+
+
+class ExtractedPage(NamedTuple):
+    """
+    Result of extracting a single page.
+
+    Attributes:
+        number (int): 1-based page number
+        text (str): Page text
+        tables (list): Tables as lists of rows
+        content (str): Text and tables formatted for the model
+        seconds (tuple): Wall time of the text extraction, table extraction and formatting
+    """
+    number: int
+    text: str
+    tables: list
+    content: str
+    seconds: tuple = (0.0, 0.0, 0.0)
+
+
+def format_page(page_num, page_text, tables):
+    """
+    Format the text and tables of a page.
+
+    Args:
+        page_num (int): 1-based page number
+        page_text (str): Page text
+        tables (list): Tables as lists of rows
+
+    Returns:
+        str: Formatted page content
+    """
+    # pandas and pdfplumber are imported on first use so importing this module stays cheap
+    import pandas as pd
+
+    extracted_content = [f"--- Page {page_num} ---\n{page_text}\n"]
+
+    for table_num, table in enumerate(tables or [], 1):
+        # Convert table to DataFrame for better formatting
+        df = pd.DataFrame(table[1:], columns=table[0])
+        table_str = f"\nTable {table_num} on Page {page_num}:\n"
+        table_str += df.to_string(index=False)
+        extracted_content.append(table_str + "\n")
+
+    return "\n".join(extracted_content)
+
+
+def parse_page_range(spec):
+    """
+    Parse a page range such as "1-3,5".
+
+    Args:
+        spec (str): Comma separated page numbers and inclusive ranges
+
+    Returns:
+        list: 1-based page numbers
+    """
+    page_numbers = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            page_numbers.extend(range(int(start), int(end) + 1))
+        else:
+            page_numbers.append(int(part))
+    return page_numbers
+
+
+def _iter_pages(pdf_path, page_numbers):
+    """Extract pages one at a time from a single open document."""
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in page_numbers:
+            page = pdf.pages[page_num - 1]
+            started = time.perf_counter()
+            page_text = page.extract_text() or ""
+            text_done = time.perf_counter()
+            tables = page.extract_tables() or []
+            tables_done = time.perf_counter()
+            content = format_page(page_num, page_text, tables)
+            seconds = (text_done - started, tables_done - text_done, time.perf_counter() - tables_done)
+            # Release the parsed page objects as soon as the page is done
+            page.close()
+            yield ExtractedPage(page_num, page_text, tables, content, seconds)
+
+
+def _extract_pages(pdf_path, page_numbers):
+    """Extract a batch of pages, run inside the worker processes."""
+    return list(_iter_pages(pdf_path, page_numbers))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    # Pools are kept for the life of the process so workers only pay the import cost once.
+    # Spawned workers never inherit the parent's threads or open files.
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pools[workers]
+
+
+def _discard_pool(workers, pool):
+    # A pool whose worker died stays broken, drop it so the next extraction starts a new one
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _map_batches(pool, pdf_path, batches, in_flight):
+    """Extract batches of pages in the pool, yielding each batch's pages in order."""
+    batches = iter(batches)
+    pending = deque()
+
+    def submit_next():
+        batch = next(batches, None)
+        if batch is not None:
+            pending.append(pool.submit(_extract_pages, pdf_path, batch))
+
+    try:
+        for _ in range(in_flight):
+            submit_next()
+
+        while pending:
+            results = pending.popleft().result()
+            submit_next()
+            yield results
+    finally:
+        # Stop outstanding work when the consumer stops early
+        for future in pending:
+            future.cancel()
+
+
+def _select_pages(pdf_path, pages, max_pages):
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+
+    if pages is None:
+        page_numbers = list(range(1, page_count + 1))
+    else:
+        page_numbers = parse_page_range(pages) if isinstance(pages, str) else list(pages)
+        for page_num in page_numbers:
+            if not 1 <= page_num <= page_count:
+                raise ValueError(f"Page {page_num} is out of range, the PDF has {page_count} pages")
+
+    if max_pages and len(page_numbers) > max_pages:
+        raise ValueError(f"{len(page_numbers)} pages selected, at most {max_pages} pages can be extracted")
+    return page_numbers
+
+
+def iter_pdf_pages(pdf_path, pages=None, workers=None, max_pages=None):
+    """
+    Extract the pages of a PDF, yielding them in page order as they finish.
+
+    With more than one worker, batches of pages are extracted in a process
+    pool. Only a few batches are in flight at a time so memory stays flat
+    regardless of how many pages the document has. When a worker dies the
+    pool is replaced and the remaining pages are retried once.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        pages (iterable or str): 1-based page numbers or a range like "1-3,5", all pages by default
+        workers (int): Number of worker processes, SOIL_EXTRACT_WORKERS by default
+        max_pages (int): Reject documents with more selected pages, SOIL_MAX_PAGES by default, 0 for no limit
+
+    Yields:
+        ExtractedPage: One result per page
+
+    Raises:
+        ValueError: A page is out of range or there are more than max_pages pages
+        BrokenProcessPool: A worker died again on the retry, most likely on this document
+    """
+    workers = workers or DEFAULT_WORKERS
+    page_numbers = _select_pages(pdf_path, pages, MAX_PAGES if max_pages is None else max_pages)
+
+    if workers <= 1 or len(page_numbers) <= PAGES_PER_TASK:
+        yield from _iter_pages(pdf_path, page_numbers)
+        return
+
+    batches = [page_numbers[i:i + PAGES_PER_TASK] for i in range(0, len(page_numbers), PAGES_PER_TASK)]
+    done = 0
+    for attempt in range(2):
+        pool = _get_pool(workers)
+        try:
+            with closing(_map_batches(pool, pdf_path, batches[done:], workers * 2)) as results:
+                for pages_done in results:
+                    done += 1
+                    yield from pages_done
+            return
+        except BrokenProcessPool:
+            # A worker crashed or was killed, e.g. out of memory on a bad PDF
+            _discard_pool(workers, pool)
+            if attempt:
+                raise
+
+
+def _recorded(pages, span):
+    # Per-page timings come back from the workers with the results
+    page_count = table_count = 0
+    totals = [0.0, 0.0, 0.0]
+    for page in pages:
+        page_count += 1
+        table_count += len(page.tables)
+        for i, seconds in enumerate(page.seconds):
+            totals[i] += seconds
+        yield page
+
+    span.set(pages=page_count, tables=table_count, text_seconds=round(totals[0], 6),
+             tables_seconds=round(totals[1], 6), format_seconds=round(totals[2], 6))
+    metrics.record_document(page_count, table_count)
+    for name, seconds in zip(("extract_text", "extract_tables", "format_tables"), totals):
+        metrics.record_stage_time(name, seconds)
+
+
+def extract_text_and_tables_from_pdf(pdf_path, pages=None, workers=None, max_pages=None):
+    """
+    Extract text and tables from a PDF using pdfplumber.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        pages (iterable or str): 1-based page numbers or a range like "1-3,5", all pages by default
+        workers (int): Number of worker processes, SOIL_EXTRACT_WORKERS by default
+        max_pages (int): Reject documents with more selected pages, SOIL_MAX_PAGES by default, 0 for no limit
+
+    Returns:
+        str: Extracted text and tables in a formatted string
+    """
+    try:
+        with metrics.stage("extraction") as span:
+            pages = iter_pdf_pages(pdf_path, pages, workers, max_pages)
+            return "\n".join(page.content for page in _recorded(pages, span))
+
+    except Exception as e:
+        return f"Error extracting text from PDF: {str(e)}"
+
+
+def extract_report(pdf_path, pages=None, workers=None, max_pages=None):
+    """
+    Extract the formatted content and the raw tables of a PDF in one pass.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        pages (iterable or str): 1-based page numbers or a range like "1-3,5", all pages by default
+        workers (int): Number of worker processes, SOIL_EXTRACT_WORKERS by default
+        max_pages (int): Reject documents with more selected pages, SOIL_MAX_PAGES by default, 0 for no limit
+
+    Returns:
+        dict: "content" as returned by extract_text_and_tables_from_pdf,
+            "tables", every table on the selected pages as a list of rows, and
+            "table_pages", the page number of each table
+    """
+    with metrics.stage("extraction") as span:
+        return assemble_report(iter_pdf_pages(pdf_path, pages, workers, max_pages), span)
+
+
+def extract_pages(pdf_path, pages=None, max_pages=None):
+    """
+    Extract the pages of a PDF in this process, without recording metrics.
+
+    For callers that run extraction in their own worker processes, whose
+    metrics would stay in the worker. The parent records them when it builds
+    the report with assemble_report.
+
+    Returns:
+        list: ExtractedPage per selected page
+    """
+    return list(iter_pdf_pages(pdf_path, pages, 1, max_pages))
+
+
+def assemble_report(pages, span):
+    """
+    Build the result of extract_report from extracted pages, recording their pages, tables and timings.
+
+    Args:
+        pages (iterable): ExtractedPage results, in page order
+        span: Span of the extraction stage, gets the page and table counts
+
+    Returns:
+        dict: As returned by extract_report
+    """
+    contents, tables, table_pages = [], [], []
+    for page in _recorded(pages, span):
+        contents.append(page.content)
+        tables.extend(page.tables)
+        table_pages.extend([page.number] * len(page.tables))
+    return {"content": "\n".join(contents), "tables": tables, "table_pages": table_pages}
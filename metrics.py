@@ -0,0 +1,308 @@
+"""
+Per-stage instrumentation: wall and CPU time, pages and tables per document,
+model token usage and estimated cost.
+
+Turned on with SOIL_METRICS=1 or by setting SOIL_METRICS_PORT, which also
+serves the metrics in Prometheus text format at http://127.0.0.1:PORT/metrics.
+Every finished stage is logged as one JSON line on the "soil.metrics" logger.
+When turned off, stage() hands back a shared no-op span, so the hot path only
+pays for a function call.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("SOIL_METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("SOIL_METRICS_HOST", "127.0.0.1")
+ENABLED = os.getenv("SOIL_METRICS", "1" if METRICS_PORT else "0").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("soil.metrics")
+
+# US dollars per 1000 prompt and completion tokens
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name: (type, help, histogram buckets)
+_METRICS = {
+    "soil_stage_seconds": ("histogram", "Wall time per stage in seconds", SECONDS_BUCKETS),
+    "soil_stage_cpu_seconds_total": ("counter", "CPU time of the thread that ran the stage in seconds", None),
+    "soil_stage_total": ("counter", "Finished stages by status", None),
+    "soil_document_pages": ("histogram", "Pages per extracted document", COUNT_BUCKETS),
+    "soil_document_tables": ("histogram", "Tables per extracted document", COUNT_BUCKETS),
+    "soil_llm_requests_total": ("counter", "Completed model requests", None),
+    "soil_llm_tokens_total": ("counter", "Model tokens by kind", None),
+    "soil_llm_cost_usd_total": ("counter", "Estimated model cost in US dollars", None),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Registry:
+    """
+    Thread-safe counters and histograms, keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        buckets = _METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                # Bucket counts are stored per bucket and summed up when exposed
+                histogram = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def exposition(self):
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            str: Metrics text, one sample per line
+        """
+        with self._lock:
+            values = {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                      for key, value in self._values.items()}
+
+        lines = []
+        for name, (kind, help_text, buckets) in _METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _log(event):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(event, default=str))
+
+
+class Span:
+    """
+    Wall and CPU time of one stage.
+
+    CPU time is that of the thread running the stage. Async stages share the
+    event loop thread, so theirs includes work interleaved from other sessions,
+    and work done in extraction worker processes is not included.
+
+    Attributes:
+        name (str): Stage name
+        fields (dict): Extra fields for the stage's log line
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        """Add fields to the log line, ``status`` overrides the status of a stage that did not raise."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        status = self.fields.pop("status", "ok")
+        if exc_type is not None:
+            status = "cancelled" if issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)) else "error"
+
+        registry.observe("soil_stage_seconds", wall, stage=self.name)
+        registry.inc("soil_stage_cpu_seconds_total", cpu, stage=self.name)
+        registry.inc("soil_stage_total", 1, stage=self.name, status=status)
+        _log({"event": "stage", "stage": self.name, "status": status,
+              "wall_seconds": round(wall, 6), "cpu_seconds": round(cpu, 6), **self.fields})
+        return False
+
+
+class _NullSpan:
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def stage(name, **fields):
+    """
+    Time a stage.
+
+    Args:
+        name (str): Stage name, the ``stage`` label of the metrics
+        **fields: Extra fields for the stage's log line
+
+    Returns:
+        Context manager yielding the Span, a no-op when metrics are turned off
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(name, fields)
+
+
+def record_stage_time(name, seconds):
+    """Record the wall time of a stage that was timed elsewhere, such as in a worker process."""
+    if ENABLED:
+        registry.observe("soil_stage_seconds", seconds, stage=name)
+
+
+def record_document(pages, tables):
+    """Record the size of an extracted document."""
+    if ENABLED:
+        registry.observe("soil_document_pages", pages)
+        registry.observe("soil_document_tables", tables)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """
+    Estimate the cost of a model request.
+
+    Returns:
+        float: Cost in US dollars, None for models without a known price
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+
+def record_usage(stage_name, model, usage):
+    """
+    Record the token usage of a model request.
+
+    Args:
+        stage_name (str): Stage that made the request
+        model (str): Model name, used to look up the price
+        usage: ``usage`` of the API response, may be None
+    """
+    if not ENABLED or usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+
+    registry.inc("soil_llm_requests_total", 1, stage=stage_name, model=model)
+    registry.inc("soil_llm_tokens_total", prompt_tokens, stage=stage_name, model=model, kind="prompt")
+    registry.inc("soil_llm_tokens_total", completion_tokens, stage=stage_name, model=model, kind="completion")
+    if cost is not None:
+        registry.inc("soil_llm_cost_usd_total", cost, stage=stage_name, model=model)
+    _log({"event": "llm_usage", "stage": stage_name, "model": model, "prompt_tokens": prompt_tokens,
+          "completion_tokens": completion_tokens, "cost_usd": None if cost is None else round(cost, 6)})
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start(port=None, host=None):
+    """
+    Start reporting: JSON stage logs on stderr and, when a port is set, the metrics endpoint.
+
+    Does nothing when metrics are turned off. Call it from the entry point
+    only, worker processes must not bind the port.
+
+    Args:
+        port (int): Port of the metrics endpoint, SOIL_METRICS_PORT by default
+        host (str): Interface to listen on, SOIL_METRICS_HOST by default
+
+    Returns:
+        ThreadingHTTPServer: The metrics server, None when not started
+    """
+    global _server
+    if not ENABLED:
+        return None
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    port = METRICS_PORT if port is None else port
+    if port and _server is None:
+        _server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="soil-metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,764 @@
+"""
+Core soil report pipeline: prompts, model calls, caching, the report store and the per-session report.
+
+Shared by the Gradio app in test.py and the batch runner. Importing it is
+cheap: the OpenAI SDK, pandas and pdfplumber are loaded on first use, or up
+front by warm_up().
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+from analytes import flag_deviations, format_deviations, load_reference_ranges, parse_analyte_tables
+from blend import plan_blends
+from cache import DEFAULT_CACHE_DIR, ResultCache, cache_key, hash_text
+from catalog import detect_nutrient_status, get_catalog
+import metrics
+from store import DEFAULT_STORE_PATH, ReportStore
+
+# Load environment variables and API keys
+load_dotenv()
+
+# Limit on model requests in flight, also the size of the connection pool
+MAX_INFLIGHT_REQUESTS = int(os.getenv("SOIL_MAX_INFLIGHT_REQUESTS", "32"))
+
+MODEL = "gpt-4"
+
+# Global limit on model requests in flight across all sessions
+llm_slots = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+
+# OpenAI client, created by get_client
+_client = None
+
+# Optional scheduler that paces and retries non-streaming model requests, see set_llm_scheduler
+llm_scheduler = None
+
+# Bump a version whenever its prompt or output format changes so cached results are not reused
+EXTRACTION_VERSION = 3
+SUMMARY_PROMPT_VERSION = 3
+QUERY_PROMPT_VERSION = 3
+RECOMMENDATION_PROMPT_VERSION = 2
+
+# Reports above this many tokens are summarized in chunks, at most SUMMARY_PARALLELISM at a time
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SOIL_SUMMARY_CHUNK_TOKENS", "3000"))
+SUMMARY_PARALLELISM = int(os.getenv("SOIL_SUMMARY_PARALLELISM", "4"))
+
+# Reference ranges used to flag analyte values, part of the summary cache key
+REFERENCE_RANGES = load_reference_ranges()
+REFERENCE_RANGES_HASH = hash_text(json.dumps(REFERENCE_RANGES, sort_keys=True))
+
+# Number of report passages sent with a question
+QUERY_PASSAGES = int(os.getenv("SOIL_QUERY_PASSAGES", "6"))
+
+# Parsed results of every report, for history and trend questions, opened by get_store
+STORE_PATH = os.getenv("SOIL_STORE_PATH", DEFAULT_STORE_PATH)
+_store = None
+
+# Cache of extracted content, summaries, answers and recommendations, opened by get_cache
+_cache = None
+
+
+def get_client():
+    """
+    Return the OpenAI client, creating it on first use.
+
+    The client is shared by every session so connections are pooled and kept alive.
+    """
+    global _client
+    if _client is None:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=MAX_INFLIGHT_REQUESTS,
+                                    max_keepalive_connections=MAX_INFLIGHT_REQUESTS)
+            )
+        )
+    return _client
+
+
+def get_cache():
+    """
+    Return the result cache, opening it on first use.
+
+    Opening indexes the cache directory, so it is left out of import and spawned workers never pay for it.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(
+            directory=os.getenv("SOIL_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_memory_bytes=int(os.getenv("SOIL_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+            max_disk_bytes=int(os.getenv("SOIL_CACHE_MAX_MB", "256")) * 1024 * 1024
+        )
+    return _cache
+
+
+def get_store():
+    """Return the report store, opening it on first use."""
+    global _store
+    if _store is None:
+        _store = ReportStore(STORE_PATH)
+    return _store
+
+
+def summary_messages(content):
+    """Build the chat messages used to summarize a soil report."""
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert assistant in soil science. Analyze the soil report and provide a detailed summary for each sample.Make sure you analyse each page of the soil report. Only list the points that needs to be addressed,like lower or higher levels of chemicals . Present the information in a clear, organized manner."
+        },
+        {
+            "role": "user",
+            "content":f"Provide an analysis of this soil report,list out the important points that need to be addressed. Make sure to analyse of all pages of soil report pdf:\n\n{content}"
+        }
+    ]
+
+
+def flagged_summary_messages(flagged):
+    """Build the chat messages used to summarize the out-of-range values of a soil report."""
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert assistant in soil science. The values of a soil report have already been checked against reference ranges and only the values outside their range are listed. For each sample, explain which levels are low or high, what that means for the soil and what needs to be addressed. Do not invent values that are not listed. Present the information in a clear, organized manner."
+        },
+        {
+            "role": "user",
+            "content": f"Provide an analysis of these out-of-range soil test results, list out the important points that need to be addressed:\n\n{flagged}"
+        }
+    ]
+
+
+def chunk_summary_messages(chunk):
+    """
+    Build the chat messages used to summarize one part of a large soil report.
+
+    The part's position is left out so its cached summary is reused when other parts change.
+    """
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert assistant in soil science. You are given one part of a larger soil report. Summarize every sample in this part, keeping sample names, values and units. Only list the points that needs to be addressed,like lower or higher levels of chemicals."
+        },
+        {
+            "role": "user",
+            "content": f"Summarize this part of the soil report:\n\n{chunk}"
+        }
+    ]
+
+
+def merge_summary_messages(summaries):
+    """Build the chat messages used to merge the summaries of the parts of a soil report."""
+    sections = "\n\n".join(f"Part {part}:\n{summary}" for part, summary in enumerate(summaries, 1))
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert assistant in soil science. Combine the summaries of the parts of a soil report into one detailed summary for each sample. Keep every sample and every point that needs to be addressed,like lower or higher levels of chemicals. Present the information in a clear, organized manner."
+        },
+        {
+            "role": "user",
+            "content": f"Combine these summaries of a soil report into one analysis:\n\n{sections}"
+        }
+    ]
+
+
+def query_messages(summary, query, passages=None, history=None):
+    """Build the chat messages used to answer a question about a soil report."""
+    extracts = "\n".join(passages or []) or "None found."
+    earlier = f"\n\nAnd these results of the farm's earlier reports:\n{history}" if history else ""
+    return [
+        {
+            "role": "system",
+            "content": "You are a soil science expert. Answer the user's question based on the provided soil report summary, the extracts from the report itself and, when given, the results of the farm's earlier reports. Be specific and refer to the data in the summary and extracts when relevant. If the information is not in them, explain that clearly."
+        },
+        {
+            "role": "user",
+            "content": f"Using this soil report summary:\n{summary}\n\nAnd these extracts from the report:\n{extracts}{earlier}\n\nAnswer this specific question: {query}"
+        }
+    ]
+
+
+def build_candidate_products(summary, k=8):
+    """
+    Pick the catalog products worth showing to the model for a summary.
+
+    Args:
+        summary (str): Summary of the soil report
+        k (int): Maximum number of candidate products
+
+    Returns:
+        str: Candidate products formatted for the prompt
+    """
+    catalog = get_catalog()
+    deficient, excess = detect_nutrient_status(summary)
+    candidates = catalog.top_k(deficient, excess, k=k)
+
+    if len(candidates) == 0:
+        # Nothing to rank against, fall back to the nutrient table of every safe product
+        return catalog.format_products(catalog.allowed(excess), with_descriptions=False)
+    return catalog.format_products(candidates)
+
+
+def recommendation_messages(summary, plan=None):
+    """
+    Build the chat messages used to recommend fertilizers for a soil report.
+
+    With a plan, the model only explains the products and rates worked out by
+    the optimizer. Without one it picks from the catalog candidates itself.
+    """
+    if plan:
+        return [
+            {
+                "role": "system",
+                "content": f"You are an expert in soil science and fertilizers. The fertilizer plan below was calculated from the soil test results. For every sample it lists the products and application rates, what they supply against the nutrient and lime targets, and the nutrients the soil already has too much of. Explain the plan to the farmer: why each product was chosen, how and when to apply it, and which targets it does not fully meet. Do not change the products or rates and do not suggest other products.\n\n{plan}"
+            },
+            {
+                "role": "user",
+                "content": f"Explain this fertilizer plan for the following soil analysis summary:\n\n{summary}"
+            }
+        ]
+
+    products = build_candidate_products(summary)
+    return [
+        {
+            "role": "system",
+            "content": f"You are an expert in soil science and fertilizers. Based on the soil analysis and the list of products provided, recommend specific fertilizer products.Make sure you dont suggest fertlisers that are rich in chemicals which already have higher levels in the soil report.Suggest Fertilisers for chemicals that have resulted in low levels in the soil report.The numbers after each product's name are the percentage of Calcium,Magnesium,Nitrogen,Phosphorus,Potassium,Sulphur respectively.\n\n{products}"
+        },
+        {
+            "role": "user",
+            "content": f"Based on this soil analysis summary and the list of products that you have, provide detailed fertilizer recommendations:\n\n{summary}"
+        }
+    ]
+
+
+async def complete_chat(messages, temperature, stage="chat"):
+    """
+    Run a chat completion and wait for the whole answer.
+
+    Args:
+        messages (list): Chat messages
+        temperature (float): Sampling temperature
+        stage (str): Stage the token usage is recorded under
+
+    Returns:
+        str: Completion text
+    """
+    if llm_scheduler is None:
+        return await _create_completion(get_client(), messages, temperature, stage)
+
+    # The scheduler owns retries, so the SDK's own retries are turned off
+    return await llm_scheduler.run(
+        lambda: _create_completion(get_client().with_options(max_retries=0), messages, temperature, stage),
+        estimate_tokens(json.dumps(messages))
+    )
+
+
+async def _create_completion(api_client, messages, temperature, stage):
+    async with llm_slots:
+        response = await api_client.chat.completions.create(
+            model=MODEL,
+            temperature=temperature,
+            messages=messages
+        )
+    metrics.record_usage(stage, MODEL, response.usage)
+    return response.choices[0].message.content.strip()
+
+
+def set_llm_scheduler(scheduler):
+    """
+    Route non-streaming model requests through a scheduler.
+
+    Args:
+        scheduler: Object with an async ``run(request, prompt_tokens)`` method that
+            awaits ``request()`` when the budget allows, or None to call the API directly
+    """
+    global llm_scheduler
+    llm_scheduler = scheduler
+
+
+async def stream_chat(messages, temperature, stage="chat"):
+    """
+    Run a chat completion, yielding the text received so far as tokens arrive.
+
+    Closing the generator closes the HTTP response, which stops the upstream
+    request when the user cancels.
+
+    Args:
+        messages (list): Chat messages
+        temperature (float): Sampling temperature
+        stage (str): Stage the token usage is recorded under
+
+    Yields:
+        str: Completion text received so far, the last value is stripped
+    """
+    parts = []
+    usage = None
+    # Usage is only sent at the end of a stream when asked for
+    options = {"stream_options": {"include_usage": True}} if metrics.ENABLED else {}
+    async with llm_slots:
+        stream = await get_client().chat.completions.create(
+            model=MODEL,
+            temperature=temperature,
+            messages=messages,
+            stream=True,
+            **options
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield "".join(parts)
+        finally:
+            await stream.close()
+            metrics.record_usage(stage, MODEL, usage)
+    yield "".join(parts).strip()
+
+
+def estimate_tokens(text):
+    """Roughly estimate the number of tokens in a text, about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def _group(pieces, max_tokens):
+    # Greedily group consecutive pieces while the group stays within the budget
+    groups, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _split_page(page, max_tokens):
+    # A page too large on its own is split between its tables and then between lines
+    pieces = []
+    for section in re.split(r"\n(?=\nTable \d+ on Page \d+:\n)", page):
+        if estimate_tokens(section) <= max_tokens:
+            pieces.append(section)
+        else:
+            pieces.extend("\n".join(lines) for lines in _group(section.split("\n"), max_tokens))
+    return ["\n".join(group) for group in _group(pieces, max_tokens)]
+
+
+def split_report(content, max_tokens=None):
+    """
+    Split extracted report content into chunks that fit the summary token budget.
+
+    Chunks are made of whole pages and end after pages picked by a hash of
+    their content, about half as many pages apart as typically fit the
+    budget, or earlier when the next page would not fit. Boundaries do not depend on
+    a page's position, so an edited page only changes its own chunk, and the
+    following ones up to the next boundary when it grows past the budget;
+    the other chunks keep their cached summaries. A page that is too large
+    on its own is split between its tables and then between lines.
+
+    Args:
+        content (str): Extracted text and tables from the PDF
+        max_tokens (int): Token budget per chunk, SUMMARY_CHUNK_TOKENS by default
+
+    Returns:
+        list: Chunks of the content, in document order
+    """
+    max_tokens = max_tokens or SUMMARY_CHUNK_TOKENS
+    pages = [page for page in re.split(r"\n(?=--- Page \d+ ---\n)", content) if page.strip()]
+    return _stable_chunks(pages, max_tokens, _split_page)
+
+
+def split_flagged(flagged, max_tokens=None):
+    """
+    Split flagged values into chunks that fit the summary token budget.
+
+    Chunks are made of whole sample lines, with boundaries picked the same
+    way as split_report so unchanged samples keep their cached summaries.
+
+    Args:
+        flagged (str): Flagged values from flagged_values
+        max_tokens (int): Token budget per chunk, SUMMARY_CHUNK_TOKENS by default
+
+    Returns:
+        list: Chunks of the flagged values, in sample order
+    """
+    max_tokens = max_tokens or SUMMARY_CHUNK_TOKENS
+    lines = [line for line in flagged.split("\n") if line.strip()]
+    return _stable_chunks(lines, max_tokens, lambda line, _: [line])
+
+
+def _stable_chunks(pieces, max_tokens, split_large):
+    # Joins consecutive pieces into chunks, ending a chunk after pieces picked by their hash or when the next does not fit
+    if not pieces:
+        return []
+    sizes = [estimate_tokens(piece) for piece in pieces]
+
+    # Half of what typically fits, so most chunks end at a hash boundary rather than where the budget runs out.
+    # Rounded down to a power of two so that editing a piece rarely changes it.
+    typical = sorted(sizes)[len(sizes) // 2]
+    pieces_per_chunk = 2 ** int(math.log2(max(1, max_tokens // (2 * typical))))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece, tokens in zip(pieces, sizes):
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        if tokens > max_tokens:
+            chunks.extend(split_large(piece, max_tokens))
+            continue
+        current.append(piece)
+        current_tokens += tokens
+        if int(hash_text(piece)[:8], 16) % pieces_per_chunk == 0:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+async def _cached_completion(kind, messages):
+    # Partial summaries are cached by their input alone, so unchanged chunks are never re-summarized
+    key = cache_key(kind, hash_text(json.dumps(messages)), MODEL, SUMMARY_PROMPT_VERSION)
+    result = await get_cache().aget(key)
+    if result is None:
+        result = await complete_chat(messages, temperature=0, stage="summary")
+        await get_cache().aset(key, result)
+    return result
+
+
+async def _map_reduce_inputs(chunks, chunk_messages=chunk_summary_messages, kind="chunk-summary"):
+    """
+    Summarize the chunks of a large report and collapse the partial summaries
+    until they fit into a single merge prompt.
+
+    Yields progress messages, the last value is the list of partial summaries.
+    """
+    limit = asyncio.Semaphore(SUMMARY_PARALLELISM)
+
+    async def run(kind, messages):
+        async with limit:
+            return await _cached_completion(kind, messages)
+
+    tasks = [asyncio.ensure_future(run(kind, chunk_messages(chunk))) for chunk in chunks]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            await task
+            yield f"Summarized {done} of {len(tasks)} parts of the report..."
+        summaries = [task.result() for task in tasks]
+
+        # Summaries of very large reports may still not fit, merge them in groups first
+        while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > SUMMARY_CHUNK_TOKENS:
+            groups = _group(summaries, SUMMARY_CHUNK_TOKENS)
+            if len(groups) == len(summaries):
+                break
+            tasks = [asyncio.ensure_future(run("merge-summary", merge_summary_messages(group))) for group in groups]
+            summaries = list(await asyncio.gather(*tasks))
+    finally:
+        # Stop outstanding chunk requests when the caller is cancelled
+        for task in tasks:
+            task.cancel()
+
+    yield summaries
+
+
+async def summarize_soil_report(content):
+    """
+    Summarize the soil report using GPT-4.
+
+    Reports larger than the chunk budget are summarized part by part and the
+    partial summaries merged in a final step.
+
+    Args:
+        content (str): Extracted text and tables from the PDF
+
+    Returns:
+        str: Detailed summary of the soil report
+    """
+    try:
+        with metrics.stage("summary", chunked=estimate_tokens(content) > SUMMARY_CHUNK_TOKENS):
+            if estimate_tokens(content) <= SUMMARY_CHUNK_TOKENS:
+                return await complete_chat(summary_messages(content), temperature=0, stage="summary")
+
+            async for summaries in _map_reduce_inputs(split_report(content)):
+                pass
+            if len(summaries) == 1:
+                return summaries[0]
+            return await complete_chat(merge_summary_messages(summaries), temperature=0, stage="summary")
+    except Exception as e:
+        return f"Error summarizing soil report: {traceback.format_exc()}"
+
+
+async def stream_summarize_soil_report(content):
+    """
+    Summarize the soil report using GPT-4, streaming the summary.
+
+    For reports larger than the chunk budget, progress messages are yielded
+    while the parts are summarized and the final merge step is streamed.
+
+    Args:
+        content (str): Extracted text and tables from the PDF
+
+    Yields:
+        str: Summary received so far
+    """
+    try:
+        with metrics.stage("summary", chunked=estimate_tokens(content) > SUMMARY_CHUNK_TOKENS):
+            if estimate_tokens(content) <= SUMMARY_CHUNK_TOKENS:
+                messages = summary_messages(content)
+            else:
+                async for progress in _map_reduce_inputs(split_report(content)):
+                    if isinstance(progress, str):
+                        yield progress
+                summaries = progress
+                if len(summaries) == 1:
+                    yield summaries[0]
+                    return
+                messages = merge_summary_messages(summaries)
+
+            async for text in stream_chat(messages, temperature=0, stage="summary"):
+                yield text
+    except Exception as e:
+        yield f"Error summarizing soil report: {traceback.format_exc()}"
+
+
+def fertilizer_plan(samples):
+    """
+    Work out fertilizer products and rates for the samples of a parsed report.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from parse_analyte_tables
+
+    Returns:
+        BlendPlan: Rates per sample, None when no samples were recognized
+    """
+    if samples is None or samples.empty:
+        return None
+    return plan_blends(samples, REFERENCE_RANGES)
+
+
+def _with_plan(plan, text):
+    return f"Fertilizer plan (kg/ha):\n{plan}\n\n{text}" if plan else text
+
+
+def flagged_values(samples):
+    """
+    Format the values of a parsed report that are outside their reference ranges.
+
+    Args:
+        samples (pd.DataFrame): Per-sample table from parse_analyte_tables
+
+    Returns:
+        str: Flagged values per sample
+    """
+    return format_deviations(samples, flag_deviations(samples, REFERENCE_RANGES))
+
+
+async def summarize_flagged_values(flagged):
+    """
+    Summarize the out-of-range values of a soil report using GPT-4.
+
+    Reports with more flagged values than fit the chunk budget, such as
+    large multi-sample bundles, are summarized in groups of samples and the
+    partial summaries merged in a final step.
+
+    Args:
+        flagged (str): Flagged values from flagged_values
+
+    Returns:
+        str: Detailed summary of the soil report
+    """
+    try:
+        with metrics.stage("summary", flagged=True, chunked=estimate_tokens(flagged) > SUMMARY_CHUNK_TOKENS):
+            if estimate_tokens(flagged) <= SUMMARY_CHUNK_TOKENS:
+                return await complete_chat(flagged_summary_messages(flagged), temperature=0, stage="summary")
+
+            async for summaries in _map_reduce_inputs(split_flagged(flagged), flagged_summary_messages,
+                                                      "flagged-summary"):
+                pass
+            if len(summaries) == 1:
+                return summaries[0]
+            return await complete_chat(merge_summary_messages(summaries), temperature=0, stage="summary")
+    except Exception as e:
+        return f"Error summarizing soil report: {traceback.format_exc()}"
+
+
+async def stream_summarize_flagged_values(flagged):
+    """
+    Summarize the out-of-range values of a soil report using GPT-4, streaming the summary.
+
+    For more flagged values than fit the chunk budget, progress messages are
+    yielded while the groups of samples are summarized and the final merge
+    step is streamed.
+
+    Args:
+        flagged (str): Flagged values from flagged_values
+
+    Yields:
+        str: Summary received so far
+    """
+    try:
+        with metrics.stage("summary", flagged=True, chunked=estimate_tokens(flagged) > SUMMARY_CHUNK_TOKENS):
+            if estimate_tokens(flagged) <= SUMMARY_CHUNK_TOKENS:
+                messages = flagged_summary_messages(flagged)
+            else:
+                async for progress in _map_reduce_inputs(split_flagged(flagged), flagged_summary_messages,
+                                                         "flagged-summary"):
+                    if isinstance(progress, str):
+                        yield progress
+                summaries = progress
+                if len(summaries) == 1:
+                    yield summaries[0]
+                    return
+                messages = merge_summary_messages(summaries)
+
+            async for text in stream_chat(messages, temperature=0, stage="summary"):
+                yield text
+    except Exception as e:
+        yield f"Error summarizing soil report: {traceback.format_exc()}"
+
+
+async def answer_query(summary, query, passages=None, history=None):
+    """
+    Answer specific questions about the soil report.
+
+    Args:
+        summary (str): Summary of the soil report
+        query (str): User's specific question
+        passages (list): Report extracts relevant to the question
+        history (str): Results of earlier reports from store.history_lookup
+
+    Returns:
+        str: Detailed answer based on the soil report
+    """
+    if not query.strip():
+        return "Please enter a question to get an answer."
+
+    try:
+        with metrics.stage("query", history=bool(history)):
+            return await complete_chat(query_messages(summary, query, passages, history), temperature=0.1, stage="query")
+    except Exception as e:
+        return f"Error answering query: {traceback.format_exc()}"
+
+
+async def stream_answer_query(summary, query, passages=None, history=None):
+    """
+    Answer specific questions about the soil report, streaming the answer.
+
+    Args:
+        summary (str): Summary of the soil report
+        query (str): User's specific question
+        passages (list): Report extracts relevant to the question
+        history (str): Results of earlier reports from store.history_lookup
+
+    Yields:
+        str: Answer received so far
+    """
+    if not query.strip():
+        yield "Please enter a question to get an answer."
+        return
+
+    try:
+        with metrics.stage("query", history=bool(history)):
+            async for text in stream_chat(query_messages(summary, query, passages, history), temperature=0.1, stage="query"):
+                yield text
+    except Exception as e:
+        yield f"Error answering query: {traceback.format_exc()}"
+
+
+async def get_fertilizer_recommendations(summary, plan=None):
+    """
+    Recommend fertilizer products for the soil report.
+
+    Args:
+        summary (str): Summary of the soil report
+        plan (str): Formatted plan from fertilizer_plan, the model explains it instead of choosing products
+
+    Returns:
+        str: The plan followed by the fertilizer recommendations
+    """
+    try:
+        with metrics.stage("recommendations", planned=bool(plan)):
+            text = await complete_chat(recommendation_messages(summary, plan), temperature=0, stage="recommendations")
+            return _with_plan(plan, text)
+    except Exception as e:
+        return f"Error generating recommendations: {traceback.format_exc()}"
+
+
+async def stream_fertilizer_recommendations(summary, plan=None):
+    """
+    Recommend fertilizer products for the soil report, streaming the recommendations.
+
+    Args:
+        summary (str): Summary of the soil report
+        plan (str): Formatted plan from fertilizer_plan, the model explains it instead of choosing products
+
+    Yields:
+        str: Recommendations received so far, the plan is shown before the explanation starts
+    """
+    try:
+        with metrics.stage("recommendations", planned=bool(plan)):
+            if plan:
+                yield _with_plan(plan, "")
+            messages = recommendation_messages(summary, plan)
+            async for text in stream_chat(messages, temperature=0, stage="recommendations"):
+                yield _with_plan(plan, text)
+    except Exception as e:
+        yield f"Error generating recommendations: {traceback.format_exc()}"
+
+
+class Report:
+    """
+    Report uploaded in a browser session.
+
+    Attributes:
+        pdf_hash (str): SHA-256 of the uploaded PDF
+        samples (pd.DataFrame): Parsed per-sample analyte table, empty when nothing was recognized
+        index (BM25Index): Lexical index over the report's pages and table rows
+        summary (str): Summary of the report
+        farm (str): Farm the report belongs to, None when unknown
+        sampled_on (str): ISO sampling date, None when unknown
+        answers (dict): Answers to earlier questions, keyed by normalized question
+    """
+
+    def __init__(self, pdf_hash, samples, index, summary=None, farm=None, sampled_on=None):
+        self.pdf_hash = pdf_hash
+        self.samples = samples
+        self.index = index
+        self.summary = summary
+        self.farm = farm
+        self.sampled_on = sampled_on
+        self.answers = {}
+
+
+def warm_up():
+    """
+    Load the heavy dependencies, the client, the cache, the catalog, the store, the parsers and the optimizer ahead of the first request.
+
+    Returns:
+        float: Seconds taken
+    """
+    started = time.perf_counter()
+    with metrics.stage("warm_up"):
+        import pandas
+        import pdfplumber
+
+        get_client()
+        get_cache()
+        get_catalog()
+        get_store()
+        # A tiny table runs the parsing and flagging code paths once
+        samples = parse_analyte_tables([[["Sample", "pH", "Olsen Phosphorus"], ["1", "5.5", "12"]]])
+        flagged_values(samples)
+        fertilizer_plan(samples)
+    return time.perf_counter() - started
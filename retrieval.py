@@ -0,0 +1,201 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from analytes import ANALYTES, DEFAULT_REFERENCE_RANGES, normalize_analyte
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+# Questions with these words need reasoning, not just values, also used by store.history_lookup
+REASONING_WORDS = re.compile(
+    r"\b(why|how|should|recommend|advise|improve|fix|increase|decrease|reduce|raise|lower|explain|mean|cause|"
+    r"affect|best|which)\b",
+    re.IGNORECASE
+)
+# Comparisons and trends take more than one value from the report
+_SEVERAL_VALUES = re.compile(r"\b(compare|compared|comparison|versus|trends?)\b", re.IGNORECASE)
+
+
+def tokenize(text):
+    """Split text into lowercase word and number tokens."""
+    return _TOKEN.findall(text.lower())
+
+
+def normalize_query(query):
+    """Normalize a question so trivially different phrasings share an answer cache entry."""
+    return " ".join(tokenize(query))
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over short passages of a single report.
+
+    Attributes:
+        passages (list): Indexed passages, in report order
+    """
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = list(passages)
+        self.k1 = k1
+        self.b = b
+        self._term_counts = [Counter(tokenize(passage)) for passage in self.passages]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._average_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0
+
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(self.passages)
+        self._idf = {term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+                     for term, frequency in document_frequency.items()}
+
+    def __len__(self):
+        return len(self.passages)
+
+    def search(self, query, k=5):
+        """
+        Find the passages that best match a query.
+
+        Args:
+            query (str): Search text
+            k (int): Maximum number of passages to return
+
+        Returns:
+            list: Matching passages, best first
+        """
+        terms = [term for term in set(tokenize(query)) if term in self._idf]
+        if not terms or not self.passages:
+            return []
+
+        scores = []
+        for counts, length in zip(self._term_counts, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self._average_length or 1))
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(score)
+
+        ranked = sorted((index for index, score in enumerate(scores) if score > 0), key=lambda index: -scores[index])
+        return [self.passages[index] for index in ranked[:k]]
+
+
+def _cell(value):
+    return re.sub(r"\s+", " ", str(value or "")).strip()
+
+
+def report_passages(report):
+    """
+    Split an extracted report into passages for the index.
+
+    Page text is indexed a few lines at a time and every table row becomes
+    its own passage, with the column headers repeated so a row can be read
+    on its own. Recognized analyte names are added to their passages so that
+    "phosphorus" also finds a row labelled "Olsen P".
+
+    Args:
+        report (dict): Result of extraction.extract_report
+
+    Returns:
+        list: Passages
+    """
+    passages = []
+    for page in re.split(r"\n(?=--- Page \d+ ---\n)", report["content"]):
+        marker = re.match(r"--- (Page \d+) ---", page)
+        label = marker.group(1) if marker else "Report"
+        # Tables are indexed row by row below
+        text = re.split(r"\n\nTable \d+ on Page \d+:\n", page)[0]
+        lines = [line.strip() for line in text.split("\n")[1:] if line.strip()]
+        for start in range(0, len(lines), 3):
+            passages.append(f"{label}: " + " ".join(lines[start:start + 3]))
+
+    table_pages = report.get("table_pages") or [None] * len(report["tables"])
+    for table, page_number in zip(report["tables"], table_pages):
+        label = f"Page {page_number} table" if page_number else "Table"
+        rows = [[_cell(cell) for cell in row] for row in table if row]
+        if len(rows) < 2:
+            continue
+        header = rows[0]
+        for row in rows[1:]:
+            fields = [f"{name}: {value}" if name else value for name, value in zip(header, row) if value]
+            names = {ANALYTES[key][0] for key, _ in (normalize_analyte(cell) for cell in [row[0]] + header) if key}
+            passages.append(f"{label}: " + " | ".join(fields) + (f" ({', '.join(sorted(names))})" if names else ""))
+
+    return passages
+
+
+def build_report_index(report):
+    """Build the BM25 index of an extracted report."""
+    return BM25Index(report_passages(report))
+
+
+def _find_sample(query, samples):
+    lowered = query.lower()
+    # Prefer the longest name so "Sample 12" wins over "Sample 1"
+    for sample in sorted(samples.index, key=lambda name: -len(str(name))):
+        # Single letters would match ordinary words in the question
+        if len(str(sample)) < 2 and not str(sample).isdigit():
+            continue
+        if re.search(rf"(?<![\w.]){re.escape(str(sample).lower())}(?![\w.])", lowered):
+            return sample
+
+    # "sample 3" or "paddock 3" when the names do not contain the word
+    named = re.search(r"\b(?:sample|paddock|block|site)\s*(?:no\.?|number|#)?\s*([a-z]?\d+[a-z]?|[a-z])\b", lowered)
+    if named and named.group(1).isdigit():
+        position = int(named.group(1))
+        if 1 <= position <= len(samples.index):
+            return samples.index[position - 1]
+    # A single sample answers questions that name none, not questions about a sample the report does not have
+    if len(samples.index) == 1 and named is None:
+        return samples.index[0]
+    return None
+
+
+def lookup_answer(query, samples, ranges=DEFAULT_REFERENCE_RANGES):
+    """
+    Answer simple value lookups such as "pH of sample 3" straight from the parsed report.
+
+    Args:
+        query (str): User's question
+        samples (pd.DataFrame): Per-sample table from analytes.parse_analyte_tables
+        ranges (dict): Reference ranges, used to say whether the value is low or high
+
+    Returns:
+        str: The answer, or None when the question needs the model
+    """
+    if samples is None or samples.empty or REASONING_WORDS.search(query) or _SEVERAL_VALUES.search(query):
+        return None
+
+    # Drop possessives so "sample's" is not read as sulphur
+    key, _ = normalize_analyte(re.sub(r"'s\b", "", query))
+    if key is not None and key.startswith("qt_") and key not in samples.columns:
+        # Cations reported in me/100g only
+        key = key[3:]
+    if key is None or key not in samples.columns:
+        return None
+    sample = _find_sample(query, samples)
+    if sample is None:
+        return None
+
+    value = samples.at[sample, key]
+    if np.isnan(value):
+        return None
+
+    unit = samples.attrs.get("units", {}).get(key) or ANALYTES[key][1]
+    answer = f"{ANALYTES[key][0]} in {sample}: {value:g} {unit}"
+    low, high = ranges.get(key, (None, None))
+    if low is not None or high is not None:
+        bounds = "-".join("" if bound is None else f"{bound:g}" for bound in (low, high))
+        if low is not None and value < low:
+            status = "below"
+        elif high is not None and value > high:
+            status = "above"
+        else:
+            status = "within"
+        answer += f", {status} the reference range of {bounds} {unit}."
+    else:
+        answer += "."
+    return answer
@@ -0,0 +1,358 @@
+import datetime
+import os
+import re
+import sqlite3
+import threading
+
+from analytes import ANALYTES, normalize_analyte
+from retrieval import REASONING_WORDS
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "soil-assistant", "reports.sqlite3")
+
+# Values are denormalized with their farm, paddock and date so trend queries are a single index range scan
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL UNIQUE,
+    farm TEXT NOT NULL COLLATE NOCASE,
+    sampled_on TEXT,
+    source TEXT,
+    summary TEXT,
+    recommendations TEXT,
+    added_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analyte_values (
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    farm TEXT NOT NULL COLLATE NOCASE,
+    paddock TEXT NOT NULL COLLATE NOCASE,
+    sample TEXT NOT NULL COLLATE NOCASE,
+    sampled_on TEXT,
+    analyte TEXT NOT NULL,
+    value REAL NOT NULL,
+    unit TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_farm_date ON reports (farm, sampled_on);
+CREATE INDEX IF NOT EXISTS values_farm_analyte ON analyte_values (farm, analyte, paddock, sampled_on);
+CREATE INDEX IF NOT EXISTS values_farm_sample ON analyte_values (farm, sample, sampled_on);
+CREATE INDEX IF NOT EXISTS values_report ON analyte_values (report_id);
+"""
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d/%m/%y", "%d.%m.%Y", "%d-%m-%Y", "%d %B %Y", "%d %b %Y", "%d-%b-%Y",
+                 "%d-%b-%y", "%B %d, %Y", "%b %d, %Y")
+_DATE = r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{1,2}[ -][A-Za-z]{3,9}[ -]\d{2,4}|[A-Za-z]{3,9} \d{1,2}, \d{4}"
+
+# Report dates by preference, the sampling date is what a trend should be plotted against
+_DATE_LABELS = [
+    re.compile(rf"\b(?:date\s+)?(?:sampled|collected|sampling\s+date)\b\s*(?:on|date)?\s*[:\-]?\s*({_DATE})", re.IGNORECASE),
+    re.compile(rf"\b(?:date\s+)?received\b\s*(?:on|date)?\s*[:\-]?\s*({_DATE})", re.IGNORECASE),
+    re.compile(rf"\b(?:report\s+)?date\b\s*[:\-]?\s*({_DATE})", re.IGNORECASE),
+]
+# Explicit time phrases that make a question about earlier reports, words such as "change" alone do not
+_EARLIER = r"(?:last|previous|prior|earlier)\s+(?:year|season|test|report|sampling|results?)"
+_HISTORY_WORDS = re.compile(
+    rf"\btrends?\b|\bover\s+time\b|\bhistor(?:y|ic|ical)\b|\b{_EARLIER}\b|\bsince\s+\d{{4}}\b"
+    rf"|\bcompared?\s+(?:to|with)\s+(?:the\s+)?(?:(?:[a-z]+\s+)?\d{{4}}|\d{{4}}-\d{{1,2}}-\d{{1,2}})\b",
+    re.IGNORECASE
+)
+# History questions that ask for the latest results against the earlier ones rather than the whole series
+_COMPARE_WORDS = re.compile(r"\b(compare|compared|comparison|since|previous|prior|last|change|changed)\b", re.IGNORECASE)
+
+_FARM_LABEL = re.compile(
+    r"^\s*(?:farm|client|property|grower|owner|customer)(?:\s+name)?\s*[:\-]\s*(.+?)"
+    r"(?=\s{2,}|\s+(?:date|page|ref|order|sampled|received|lab)\b|$)",
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def parse_date(text):
+    """
+    Parse a report date, day first as on New Zealand reports.
+
+    Returns:
+        str: ISO date, None when the text is not a recognized date
+    """
+    text = re.sub(r"\s+", " ", (text or "").strip())
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def detect_report_metadata(content):
+    """
+    Find the farm and the sampling date in the text of a soil report.
+
+    Args:
+        content (str): Extracted report content
+
+    Returns:
+        tuple: (farm, ISO date), either may be None
+    """
+    farm = None
+    match = _FARM_LABEL.search(content or "")
+    if match:
+        farm = match.group(1).strip(" ,;") or None
+
+    sampled_on = None
+    for pattern in _DATE_LABELS:
+        for match in pattern.finditer(content or ""):
+            sampled_on = parse_date(match.group(1))
+            if sampled_on:
+                break
+        if sampled_on:
+            break
+    return farm, sampled_on
+
+
+class ReportStore:
+    """
+    SQLite store of parsed report results, for history and trend queries.
+
+    Every report keeps its summary and recommendations, and every sample's
+    analyte values are indexed by farm, paddock, sample and sampling date.
+    Samples are usually named after their paddock, so the sample name is the
+    paddock unless a record maps it to another one.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Shared by every session, the lock serializes access to the one connection
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add_report(self, sha256, farm, sampled_on, samples, summary=None, recommendations=None, source=None,
+                   paddocks=None):
+        """Store one report, see add_reports."""
+        self.add_reports([{
+            "sha256": sha256, "farm": farm, "sampled_on": sampled_on, "samples": samples, "summary": summary,
+            "recommendations": recommendations, "source": source, "paddocks": paddocks,
+        }])
+
+    def add_reports(self, records, batch_size=200):
+        """
+        Store reports, replacing the values of reports stored before.
+
+        Reports are written in transactions of ``batch_size`` reports, so bulk
+        imports pay for one commit per batch instead of one per row.
+
+        Args:
+            records (list): Dicts with "sha256", "farm", "sampled_on" (ISO date), "samples"
+                (per-sample DataFrame from analytes.parse_analyte_tables) and optionally
+                "summary", "recommendations", "source" and "paddocks" ({sample: paddock})
+            batch_size (int): Reports per transaction
+        """
+        added_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+        with self._lock:
+            for start in range(0, len(records), batch_size):
+                with self._connection:
+                    for record in records[start:start + batch_size]:
+                        self._write_report(record, added_at)
+
+    def _write_report(self, record, added_at):
+        farm = record.get("farm") or ""
+        sampled_on = record.get("sampled_on")
+        self._connection.execute(
+            "INSERT INTO reports (sha256, farm, sampled_on, source, summary, recommendations, added_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (sha256) DO UPDATE SET farm = excluded.farm, sampled_on = excluded.sampled_on, "
+            "source = COALESCE(excluded.source, source), summary = COALESCE(excluded.summary, summary), "
+            "recommendations = COALESCE(excluded.recommendations, recommendations)",
+            (record["sha256"], farm, sampled_on, record.get("source"), record.get("summary"),
+             record.get("recommendations"), added_at)
+        )
+        report_id = self._connection.execute("SELECT id FROM reports WHERE sha256 = ?", (record["sha256"],)).fetchone()[0]
+        self._connection.execute("DELETE FROM analyte_values WHERE report_id = ?", (report_id,))
+
+        samples = record.get("samples")
+        if samples is None or samples.empty:
+            return
+        units = samples.attrs.get("units", {})
+        paddocks = record.get("paddocks") or {}
+        # Analytes a sample has no value for are not stored
+        values = samples.stack().dropna()
+        self._connection.executemany(
+            "INSERT INTO analyte_values (report_id, farm, paddock, sample, sampled_on, analyte, value, unit) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(report_id, farm, str(paddocks.get(sample, sample)), str(sample), sampled_on, analyte, float(value),
+              units.get(analyte) or ANALYTES[analyte][1])
+             for (sample, analyte), value in values.items()]
+        )
+
+    def set_recommendations(self, sha256, recommendations):
+        """Attach recommendations to a stored report."""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE reports SET recommendations = ? WHERE sha256 = ?",
+                                     (recommendations, sha256))
+
+    def reports(self, farm):
+        """
+        List the stored reports of a farm, oldest first.
+
+        Returns:
+            list: Dicts with sha256, sampled_on, source and summary
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT sha256, sampled_on, source, summary FROM reports WHERE farm = ? ORDER BY sampled_on, id",
+                (farm,)
+            ).fetchall()
+        return [dict(zip(("sha256", "sampled_on", "source", "summary"), row)) for row in rows]
+
+    def paddocks(self, farm):
+        """Return the paddock names stored for a farm."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT paddock FROM analyte_values WHERE farm = ? ORDER BY paddock", (farm,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def trend(self, farm, analyte, paddock=None):
+        """
+        Values of one analyte over time.
+
+        Args:
+            farm (str): Farm name, case insensitive
+            analyte (str): Canonical analyte key
+            paddock (str): Only this paddock, every paddock by default
+
+        Returns:
+            list: (sampled_on, paddock, value, unit) tuples, by paddock and then date
+        """
+        query = "SELECT sampled_on, paddock, value, unit FROM analyte_values WHERE farm = ? AND analyte = ?"
+        parameters = [farm, analyte]
+        if paddock:
+            query += " AND paddock = ?"
+            parameters.append(paddock)
+        query += " ORDER BY paddock, sampled_on, report_id"
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def compare(self, farm, analyte=None, paddock=None):
+        """
+        Compare the latest value of every paddock and analyte with the one before it.
+
+        Args:
+            farm (str): Farm name, case insensitive
+            analyte (str): Only this analyte key, every analyte by default
+            paddock (str): Only this paddock, every paddock by default
+
+        Returns:
+            list: Dicts with paddock, analyte, unit, previous_on, previous, latest_on and latest,
+                the previous ones are None for paddocks tested only once
+        """
+        conditions, parameters = ["farm = ?"], [farm]
+        if analyte:
+            conditions.append("analyte = ?")
+            parameters.append(analyte)
+        if paddock:
+            conditions.append("paddock = ?")
+            parameters.append(paddock)
+        query = (
+            "SELECT paddock, analyte, unit, sampled_on, value FROM ("
+            " SELECT paddock, analyte, unit, sampled_on, value, ROW_NUMBER() OVER ("
+            "  PARTITION BY paddock, analyte ORDER BY sampled_on DESC, report_id DESC) AS position"
+            f" FROM analyte_values WHERE {' AND '.join(conditions)}"
+            ") WHERE position <= 2 ORDER BY paddock, analyte, position"
+        )
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+
+        comparisons = {}
+        for paddock_name, key, unit, sampled_on, value in rows:
+            entry = comparisons.get((paddock_name, key))
+            if entry is None:
+                comparisons[(paddock_name, key)] = {
+                    "paddock": paddock_name, "analyte": key, "unit": unit, "latest_on": sampled_on, "latest": value,
+                    "previous_on": None, "previous": None,
+                }
+            else:
+                entry["previous_on"], entry["previous"] = sampled_on, value
+        return list(comparisons.values())
+
+
+def format_trend(rows, analyte):
+    """Format the result of ReportStore.trend, one line per paddock."""
+    name = ANALYTES[analyte][0]
+    lines, by_paddock = [], {}
+    for sampled_on, paddock, value, unit in rows:
+        by_paddock.setdefault(paddock, []).append(f"{sampled_on or 'undated'}: {value:g} {unit}")
+    for paddock, points in by_paddock.items():
+        lines.append(f"{name} in {paddock}: " + ", ".join(points))
+    return "\n".join(lines)
+
+
+def format_comparison(comparisons):
+    """Format the result of ReportStore.compare, one line per paddock and analyte."""
+    lines = []
+    for entry in comparisons:
+        name = ANALYTES[entry["analyte"]][0]
+        latest = f"{entry['latest']:g} {entry['unit']} ({entry['latest_on'] or 'undated'})"
+        if entry["previous"] is None:
+            lines.append(f"{entry['paddock']} {name}: {latest}, no earlier result")
+            continue
+        change = entry["latest"] - entry["previous"]
+        lines.append(f"{entry['paddock']} {name}: {latest}, was {entry['previous']:g} ({entry['previous_on'] or 'undated'}),"
+                     f" change {change:+g}")
+    return "\n".join(lines)
+
+
+def _find_paddock(query, paddocks):
+    lowered = query.lower()
+    # Prefer the longest name so "Paddock 12" wins over "Paddock 1"
+    for paddock in sorted(paddocks, key=lambda name: -len(name)):
+        if len(paddock) < 2 and not paddock.isdigit():
+            continue
+        if re.search(rf"(?<![\w.]){re.escape(paddock.lower())}(?![\w.])", lowered):
+            return paddock
+    return None
+
+
+def history_lookup(store, farm, query):
+    """
+    Answer trend and comparison questions such as "pH trend in paddock 3" from the stored reports.
+
+    Plain requests for the stored values, "pH trend in paddock 3" or "What was the
+    pH last year?", are answered by them alone. Questions that need reasoning,
+    such as "Why has the pH dropped since last year?", go to the model with them.
+
+    Args:
+        store (ReportStore): Report store
+        farm (str): Farm of the current report
+        query (str): User's question
+
+    Returns:
+        tuple: (history, plain), the stored values relevant to the question, None when it is not about
+            history or nothing is stored for the farm, and whether they answer it without the model
+    """
+    if not farm or not _HISTORY_WORDS.search(query):
+        return None, False
+    plain = not REASONING_WORDS.search(query)
+
+    # Drop possessives so "paddock's" is not read as sulphur
+    key, _ = normalize_analyte(re.sub(r"'s\b", "", query))
+    paddock = _find_paddock(query, store.paddocks(farm))
+    if key is not None and not _COMPARE_WORDS.search(query):
+        rows = store.trend(farm, key, paddock)
+        if not rows and key.startswith("qt_"):
+            # Cations reported in me/100g only
+            key = key[3:]
+            rows = store.trend(farm, key, paddock)
+        return format_trend(rows, key) or None, plain
+
+    comparisons = store.compare(farm, key, paddock)
+    if not comparisons and key is not None and key.startswith("qt_"):
+        comparisons = store.compare(farm, key[3:], paddock)
+    return format_comparison(comparisons) or None, plain
@@ -1,390 +1,403 @@
-import gradio as gr
-from openai import OpenAI
-import pdfplumber
+import asyncio
 import os
-import tempfile
-from dotenv import load_dotenv
+import time
 import traceback
-import pandas as pd
 
-# Load environment variables and API keys
-load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")
+_import_started = time.perf_counter()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=API_KEY)
+from analytes import ANALYTES, parse_analyte_tables
+from cache import cache_key, hash_file, hash_text
+from extraction import extract_report
+import metrics
+from pipeline import (EXTRACTION_VERSION, MODEL, QUERY_PASSAGES, QUERY_PROMPT_VERSION, RECOMMENDATION_PROMPT_VERSION,
+                      REFERENCE_RANGES, REFERENCE_RANGES_HASH, SUMMARY_PROMPT_VERSION, Report, fertilizer_plan, flagged_values,
+                      get_cache, get_store, stream_answer_query, stream_fertilizer_recommendations, stream_summarize_flagged_values,
+                      stream_summarize_soil_report, warm_up)
+from retrieval import build_report_index, lookup_answer, normalize_query
+from store import detect_report_metadata, format_comparison, format_trend, history_lookup, parse_date
 
+# Serving limits for multi-user deployments
+QUEUE_CONCURRENCY = int(os.getenv("SOIL_QUEUE_CONCURRENCY", "32"))
+UPLOAD_CONCURRENCY = int(os.getenv("SOIL_UPLOAD_CONCURRENCY", "4"))
+QUEUE_MAX_SIZE = int(os.getenv("SOIL_QUEUE_MAX_SIZE", "256"))
 
-def extract_text_and_tables_from_pdf(pdf_path):
-    """
-    Extract text and tables from a PDF using pdfplumber.
+# Larger uploads are rejected before they are read
+MAX_UPLOAD_MB = int(os.getenv("SOIL_MAX_UPLOAD_MB", "50"))
 
-    Args:
-        pdf_path (str): Path to the PDF file
+# Uploaded files are removed by Gradio after this many seconds
+UPLOAD_TTL_SECONDS = int(os.getenv("SOIL_UPLOAD_TTL_SECONDS", "3600"))
 
-    Returns:
-        str: Extracted text and tables in a formatted string
-    """
-    try:
-        extracted_content = []
-
-        with pdfplumber.open(pdf_path) as pdf:
-            # Process each page
-            for page_num, page in enumerate(pdf.pages, 1):
-                # Extract text
-                page_text = page.extract_text() or ""
-                extracted_content.append(f"--- Page {page_num} ---\n{page_text}\n")
-
-                # Extract tables
-                tables = page.extract_tables()
-                if tables:
-                    for table_num, table in enumerate(tables, 1):
-                        # Convert table to DataFrame for better formatting
-                        df = pd.DataFrame(table[1:], columns=table[0])
-                        table_str = f"\nTable {table_num} on Page {page_num}:\n"
-                        table_str += df.to_string(index=False)
-                        extracted_content.append(table_str + "\n")
-
-        return "\n".join(extracted_content)
+# Load the heavy dependencies before the first upload instead of during it
+WARM_UP = os.getenv("SOIL_WARM_UP", "1") == "1"
 
-    except Exception as e:
-        return f"Error extracting text from PDF: {str(e)}"
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 
-def summarize_soil_report(content):
-    """
-    Summarize the soil report using GPT-4.
+def _visible(visible):
+    # Gradio is only imported by the handlers and create_app, so worker processes that import this module skip it
+    import gradio as gr
+    return gr.update(visible=visible)
 
-    Args:
-        content (str): Extracted text and tables from the PDF
 
-    Returns:
-        str: Detailed summary of the soil report
-    """
+def _hidden_outputs(message, report=None):
+    return message, _visible(False), _visible(False), _visible(False), None, None, report
+
+
+def _discard(path):
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert assistant in soil science. Analyze the soil report and provide a detailed summary for each sample.Make sure you analyse each page of the soil report. Only list the points that needs to be addressed,like lower or higher levels of chemicals . Present the information in a clear, organized manner."
-                },
-                {
-                    "role": "user",
-                    "content":f"Provide an analysis of this soil report,list out the important points that need to be addressed. Make sure to analyse of all pages of soil report pdf:\n\n{content}"
-                }
-            ]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error summarizing soil report: {traceback.format_exc()}"
+        os.unlink(path)
+    except OSError:
+        pass
 
 
-def answer_query(summary, query):
+async def process_pdf(pdf_path, farm=None, sampled_on=None):
     """
-    Answer specific questions about the soil report.
+    Process the uploaded PDF file, streaming the summary as it is generated.
+
+    The file Gradio saved is read in place, it is never loaded into memory
+    as a whole. Files over the size or page limits are rejected and removed
+    before extraction starts. Reports of a known farm are added to the
+    report store once summarized.
 
     Args:
-        summary (str): Summary of the soil report
-        query (str): User's specific question
+        pdf_path (str): Path of the uploaded PDF file
+        farm (str): Farm name, read from the report when empty
+        sampled_on (str): Sampling date, read from the report when empty
 
-    Returns:
-        str: Detailed answer based on the soil report
+    Yields:
+        Tuple of outputs for Gradio interface, the last one is the session's Report
     """
-    if not query.strip():
-        return "Please enter a question to get an answer."
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            temperature=0.1,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a soil science expert. Answer the user's question based on the provided soil report summary. Be specific and refer to the data in the summary when relevant. If the information is not in the summary, explain that clearly."
-                },
-                {
-                    "role": "user",
-                    "content": f"Using this soil report summary:\n{summary}\n\nAnswer this specific question: {query}"
-                }
-            ]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error answering query: {traceback.format_exc()}"
+    if pdf_path is None:
+        yield _hidden_outputs("Please upload a PDF file.")
+        return
 
+    size = os.path.getsize(pdf_path)
+    if size > MAX_UPLOAD_MB * 1024 * 1024:
+        _discard(pdf_path)
+        yield _hidden_outputs(f"The PDF is {size / (1024 * 1024):.1f} MB, the limit is {MAX_UPLOAD_MB} MB.")
+        return
 
-def get_fertilizer_recommendations(summary):
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are an expert in soil science and fertilizers. Based on the soil analysis and the list of products provided, 
-                    recommend specific fertilizer products.Make sure you dont suggest fertlisers that are rich in chemicals which already have higher levels in the soil report.Suggest Fertilisers for chemicals that have resulted in low levels in the soil report.
-                    data-nitrophoska-extra,"Give your veges a nutrient spruce up with this tailored mix, developed for speciality crops in glasshouses or home gardens.    Great for specialty crops and all crops kept under glass or in the home garden.   Can also be used on lawns.   Contains potassium sulfate so it can be used on chloride-sensitive crops such as flowers, potatoes, lettuce, tomatoes, strawberries, citrus, and avocados. ",3.8,1.2,12,5.2,14,8(:The number in front of each product's description is the ratio of Calcium,Magnesium,Nitrogen,Phosphorus,Potassium,Sulphur respectively)
-                    cropmaster®-dap,"Cost-effective option with a great balance of nitrogen and phosphate, for use on various crops, from field crops to green feed brassicas, and animal pastures.    Used on field crops, greenfeed brassicas, sheep, beef and dairy pasture.   Has good spreading and flow characteristics. ",0,0,17.6,20,0,1
-                    potash-gold-14-7-14,Geared towards valuable crops that are sensitive to chloride and salt.The sulfate-sulfur is easily absorbed by your plants.   The macronutrient mix provided will suit most horticultural needs. ,2.4,0,14.3,7,14.5,6.7
-                    cropmaster®-brassica-boron-blend,"Supplies the vital elements for brassica growth, nitrogen and phosphorus. Potassium is also added for areas with low to moderate soil potash levels.    Offers Nitrogen (13.9%), Phosphorus (15.4%), and Potassium (9.5%) with added Boron for forage brassicas. Nitrogen and Phosphorus are crucial for brassica growth.   Added Boron helps prevent disease (in boron-deficient crops). ",0,0,13.6,15.4,9.5,0.8
-                    35-potash-gold-super-0-6-15,Geared towards valuable crops that are sensitive to chloride and salt.The sulphate-sulphur is easily absorbed by your plants.   The macronutrient mix provided will suit most horticultural needs. ,13,0,0,5.9,14.5,13.5
-                    cropmaster®-brassica-mix,"Supplies the vital elements of nitrogen and phosphorus and potassium, for brassica to grow and thrive. Potassium is also added for areas with low to moderate soil potash levels.    Offers nitrogen (13.9%), phosphorus (15.4%), and potassium (9.5%) – all are crucial for brassica growth.   Potassium is also added for areas with low to moderate soil potash levels. ",0,0,14.1,16,10,0.8
-                    nitro-s™,"  A well-balanced blend of N Protect (65%) and Sulphur 90 (35%).   Nitrogen provides protection from the volatilisation losses, and Sulphur 90 provides short and medium-term sulphur availability.",0,0,29.8,0,0,31.5
-                    aglime,"Using lime boosts soil health and pasture growth by changing the soil pH, which helps plants absorb nutrients    Handy for managing soil acidity in New Zealand – without lime, soil pH naturally decreases over time.   Essential for cultivating legumes in NZ.   The lower the starting pH and the higher the lime application, the better the pasture growth. ",0,0,0,0,0,0
-                    flexi-n-north-island,"coated urea product designed for mixing with superphosphate for spreading 
-                     ",0,0.5,45.3,0,0,0
-                    nitro-s™-1,  Contains Urea (65%) and Sulphur 90 (35%).   Fast acting nitrogen form of Urea with the Sulphur 90 providing short and medium-term sulphur availability.,0,0,29.9,0,0,31.5
-                    cropmaster®-16-high-k-bulk,"A great balance of nitrogen (15.5%), phosphate (7%) and potassium (22.5%) for field crops, greenfeed brassicas, sheep, beef and dairy pasture.    A great blend of DAP with Urea and chipped potassium chloride.   Cost-effective option especially post supplement harvest (Hay/Silage).   Designed to spread evenly and smoothly, for a consistent coverage. ",0,0,15.4,7,22.5,0.4
-                    potash-gold-15-10-10,Geared towards valuable crops that are sensitive to chloride and salt.    The sulfate-sulfur is easily absorbed by your plants.   The macronutrient mix provided will suit most horticultural needs. ,0,0,14.2,10,9.5,10.8
-                    ureammopot,"  Ideal blend to kick-start spring growth, to provide immediately avail N, S and P, especially in soils that have lost winter nutrients due to high rainfall.   Great for the West Coast, Golden Bay and Taranaki areas.",0,0,25.7,0,10,9.7
-                    dicalcic-high-s,"  Maintains the pH of your soil.   Provides a slower, more continuous release of phosphate over time as some phosphate reversion occurs in manufacture.  Reversion refers to the process where some of the soluble phosphate changes back into a less soluble form, making it available to plants more slowly over time.",26.9,0,0,4.2,0,9.3
-                    ammo-phos®-map,"Great option for use with Hycrop pea fertiliser mixes for potatoes and forage brassica crops. It can also be used in base fertiliser mixes that are crafted for cereals and maize.    Good when a high phosphate supply is needed.   Well-suited for use with equipment that places fertiliser or seeds directly in the soil during planting, either in rows (drilling) or in narrow strips (banding).   Less risk of seed burning than DAP because it releases almost no free ammonia.   MAP-based products perform better on alkaline soils than DAP. ",0,0,10,22,0,1
-                    potash-gold-7-15-13,Geared towards valuable crops that are sensitive to chloride and salt.    The sulfate-sulfur is easily absorbed by your plants.   The macronutrient mix provided will suit most horticultural needs. ,0,0,7,15.4,12.5,6.1
-                    sechura-rpr, ,28,0,0,10.7,0,0
-                    cobalt-super-1kg-cobalt-sulphate-is-21-co,"  Cobalt supplement for the prevention and treatment of cobalt deficiency   Cobalt deficiency is common in North Island pumice soils, parts of Southland and some areas in the top if the South Island.   The addition of cobalt will lift the pasture Cobalt levels passing to livestock through ingestion.",20,0,0,9,0,11
-                    lime-reverted-super,"Lime Reverted Super is an economic option when inputs of P and S, as well as a boost to pH levels are required. The reaction of Lime and Superphosphate makes the resulting mix safe for mixing with seeds.
-                     ",24,0,0,6.8,0,8.3
-                    moly-sulphur-super-30-120g-mo,A blend of Sulphur Super 30 with trace amounts of Molybdenum. Molybdenum deficiency is more common in soils with lower   Provides plants with a readily available supply of molybdenum   Is particularly important for nitrogen fixation by leguminous plants   Minute quantities of product are required for optimum legume growth   Ideally applied as a maintenance programme,16,0,0,7,0,30.1
-                    10-potash-super,"A readily available source of phosphorous, sulphur and potassium.
-                      Usually applied as a base dressing or as a maintenance dressing.   An effective source of phosphorous, sulphur and potassium.   There&rsquo;s a range of differing ratios of superphosphate and potassium chloride in these various potash mixes, making it easy to select the right product for your soil, depending on your potassium availability.",18,0,0,8.1,5,9.9
-                    cobalt-super-1-5kg-cobalt-sulphate-is-21-co,"Cobalt Super is a blend of Superphosphate with Cobalt. Cobalt is essential to address animal health issues in cobalt deficient soils. 
-                      Cobalt supplement for the prevention and treatment of cobalt deficiency   Cobalt deficiency is common in North Island pumice soils, parts of Southland and some areas in the top if the South Island.   The addition of cobalt will lift the pasture Cobalt levels passing to livestock through ingestion.",20,0,0,9,0,11
-                    moly-super-200g-mo,  Provides plants with a readily available supply of molybdenum   Is particularly important for nitrogen fixation by leguminous plants   Minute quantities of product are required for optimum legume growth   Ideally applied as a capital rate,20,0,0,9,0,11
-                    selenium-super,"  Treatment and prevention of selenium deficiency in grazing animals   Selenium deficiency can cause white muscle disease, poor growth in calves, lambs and fawns.   Selenium deficiency can cause low fertility in sheep and poor milk production in cattle.",20,0,0,9,0,11
-                    moly-super-120g-mo,Molybdenum deficiency is more common in soils with lower  Provides plants with a readily available supply of molybdenum. Is particularly important for nitrogen fixation by leguminous plants. Minute quantities of product are required for optimum legume growth. Ideally applied as a maintenance programme. ,20,0,0,9,0,11
-                    dap-13-s,"Ideal pastoral option where nitrogen and phosphate are required, with both readily available and slower release sulphur.    Provides nitrogen (10.8%), phosphate (14.8%) & sulphur (12.6%) for existing pastures.   Advise prompt application to avoid product from becoming lumpy. ",6.4,0,10.6,14.8,0,12.6
-                    20-potash-super-mag-n,"More powerful option for maintenance or pasture development, especially when there’s risk of low nitrogen and a fast-acting product is needed.    Get quicker results on forage crops or gardens, where plants need an immediate boost.   The nutrients are easily soluble, so plants can respond right away.   Contains more potassium, ideal where soils are potassium deficient. ",10.2,3.7,5.5,4.6,10,5.8
-                    nitrogen-super," for use on pastures as well as sowing with cereals, where a nitrogen boost ",14,0,6,6.3,0,14.6
-                    15-potash-serpentine-super,"A solid all-around option for planting new pastures, Serpentine Super is near pH neutral so there’s little risk of seed burn. •	A well-balanced mix of phosphorus, potassium, sulphate sulphur and magnesium.",12.8,4.7,0,5.7,7.5,7.3
-                    20-potash-serpentine-super,"A reliable choice when developing new pastures, Serpentine Super is near pH neutral so there’s little risk of seed burn.    A great mix of phosphorus, potassium, sulphate sulphur and magnesium.   Contains more potassium, ideal where soils are potassium deficient. ",12,4.4,0,5.4,10,6.9
-                    magnesium-super,A cost-effective way to provide magnesium to pastures where the soil is deficient.    Useful on yellow brown pumice soils where your soil type contains little or no magnesium. ,18.4,3.2,0,8.3,0,10.1
-                    magnesium-oxide,"A great source of magnesium, suited to pastoral, arable and horticultural applications.    Cost-effective source of magnesium where large amounts are required.   Maintain or increase soil pasture magnesium levels, both for plant and animal requirements. ",0,40,0,0,0,0
-                    sulphur-super-20,"A blend of Sulphur super 30 and Superphosphate, great for maintenance when topdressing isn’t done frequently.    This blend (50/50 Sulphate: elemental S), offers both fast-acting sulphate-S and medium-term release Elemental-S.   Different ratios will result in varying sulphur levels and distinct products, offering you more flexibility. ",18,0,0,8,0,20.6
-                    15-potash-super-mag-n,"Ideal for everyday maintenance or pasture development, especially when there’s risk of low nitrogen and a fast-acting product is needed.    Perfect for quick results in forage crops, or gardens where plants need an immediate boost.   The nutrients are easily soluble, so plants can respond right away. ",10.8,4,5.9,4.8,7.5,6.2
-                    sulphur-90,"Supplementing your soluble sulphate fertilisers with Sulphur 90 will keep sulphur levels up throughout the growing season, so plants get a steady supply.    It’s easier for plants to absorb (as the elemental sulphur particles convert to sulphate sulphur).   Supplementing soluble sulphate fertilisers with Sulphur 90 will ensure sulphur isn’t depleted in the growing season.   Sulphur 90 is a fertiliser made up of thousands of tiny particles of elemental sulphur per split pea shaped pastille. ",0,0,0,0,0,90
-                    esta®-kieserite-granular,"Popular for use on fast-growing crops, gardens and maize, containing magnesium and sulphur in forms that plants can easily absorb.    A great source of magnesium and sulphur source for all short-term crops and in all types of soil, regardless of soil pH.   Contains magnesium and sulphur in water soluble forms, which the plants can absorb. ",0,15,0,0,0,20
-                    sulphur-super-15,"Great for maintenance when topdressing is less frequent, and ideal when there's a higher demand for sulphur compared to phosphorus. Suitable for higher rainfall areas or where biennial application is needed.    Quick acting sulphate-S and medium-term release Elemental-S.   Flexibility, as different ratios produce different sulphur levels. ",19.2,0,0,8.6,0,14.8
-                    20-potash-sulphur-super,"A fast-acting choice for routine maintenance on potassium deficient soils.    A great mix of soluble phosphate, potassium, calcium and sulphur.   Has both quick-acting sulphate sulphur, and medium-term release elemental sulphur.   Suitable for maintenance on potassium deficient soil, or post-harvest of supplements (Hay/Silage). ",14.4,0,0,6.4,10,16.4
-                    super-mag-n,"Developed for pastoral maintenance or development  A multi-nutrient fertiliser which suits many different land uses, especially when five of the major nutrients are required.   Ideal for forage cropping, arable or horticultural situations where fast responses are needed, as nutrients are quickly absorbed by plants.",12.8,4.7,6.9,5.7,0,7.3
-                    50-potash-super,"A readily available source of phosphorous, sulphur and potassium  Usually applied as a base dressing or as a maintenance dressing. An effective source of phosphorous, sulphur and potassium. There&rsquo;s a range of differing ratios of superphosphate and potassium chloride in these various potash mixes, making it easy to select the right product for your soil, depending on your potassium availability. ",10,0,0,4.5,25,5.5
-                    sulphur-super-30,"Excellent option for maintenance when topdressings are infrequent, containing fast-acting Sulphate-S and medium-term release Elemental-S.    Fast acting, as granules oxidise in soil over about 12-24 months. ",16,0,0,7,0,30.1
-                    30-potash-serpentine-super," for planting new pastures  A well-balanced mix of phosphorus, potassium, sulphate and magnesium. <br />A good general fertiliser that can be used when sowing new pastures ",10.5,3.9,0,4.7,15,6
-                    20-potash-super,"A readily available source of phosphorous, sulphur and potassium.
-                      Usually applied as a base dressing or as a maintenance dressing.   An effective source of phosphorous, sulphur and potassium.   There&rsquo;s a range of differing ratios of superphosphate and potassium chloride in these various potash mixes, making it easy to select the right product for your soil, depending on your potassium availability.",16,0,0,7.2,10,8.8
-                    40-potash-super,"A readily available source of phosphorous, sulphur and potassium.  Usually applied as a base dressing or as a maintenance dressing.   An effective source of phosphorous, sulphur and potassium.   There&rsquo;s a range of differing ratios of superphosphate and potassium chloride in these various potash mixes, making it easy to select the right product for your soil, depending on your potassium availability.",12,0,0,5.4,20,6.6
-                    30-potash-sulphur-super,"  Contains soluble phosphate, potassium, calcium, and sulphur Has both quick acting sulphate S &amp; medium term release elemental S Suitable type of fertiliser for mostly maintenance applications on pastoral soils ",12.6,0,0,5.6,15,14.4
-                    pasture-6-ravensdown-bulk,"  Used for pastoral maintenance or development, particularly where nitrogen status of the soil is expected to be low.   Ideal for forage cropping, to arable or horticultural situations.   Use when immediate absorption and responses are needed.",12.1,0,5.5,5.5,6,13
-                    lucerne-mix-te,"  Contains the essential trace elements for healthy lucerne production.   Use only once every 2-3 years on lucerne, to ensure there is no oversupply of key trace elements.",12.4,0,0,5.5,14.7,13.2
-                    cropmaster®-11,"  Provides a balanced mix of N (10.8%), P (12%) and K (20%).   Ideal on field crops and greenfeed brassicas.",0,0,10.6,12,20,0.6
-                    cropmaster®-13,"  Provides a balanced mix of N(12.6%), P (14%) and K (15%) specifically for greenfeed brassicas, particularly in areas of higher rainfall or where potassium is limited.   Potassium plays an important function in plant water regulation.",0,0,12.3,14,15,0.7
-                    compound-premium-sop,"Ideal for avocados, grapes, lettuces, melons, cucumbers, peppers, and all crops under glass and home gardens.
-                      Contains N in both the nitrate and ammoniacal form for immediate and rapid availability to the germinating seedling or transplant.   Contains potassium in the form of SOP (sulphate of potash) so it can be used on chloride-sensitive crops.   Has a near-neutral effect on the soil pH, which is important when banding the product&#8203;.   Ideal product for row crop application and precision planting.   An all-round option for any avid home gardener.",0,1.2,12,5.2,14.1,10
-                    cropmaster®-15," 15 was originally designed for cereal cropping & has a range of other uses including maize, grass re-establishment, and pasture for hay
-                      A cost-effective product providing (15.1%), P (10%), K (10%) and S (7.7%).   Ideal for field crops, sheep, beef and dairy pasture.   Great for cropping situations where potassium is required.",0,0,14.8,10,10,7.4
-                    cropmaster®-20,"An affordable fertiliser that offers easily accessible nitrogen in the ammonium form. It also contains phosphate and sulphate sulphur.    Delivers nitrogen (18.8%), phosphorus (10%), and sulphur (12%) for various crops like field crops, green feed brassicas, and pastures for sheep, beef, and dairy.   Ideal for cropping situations where potassium isn't needed. ",0,0,18.8,10,0,12
-                    15-potash-super,"Potash Super is a blend of Superphosphate and Potassium Chloride that helps support plant growth. It’s usually applied to land before sowing with seed or to established pastures for maintaining.    Is a good source of phosphorous, sulphur, and potassium to support plant growth.   Select the right product for your situation from the wide range of Potash Supers.   Helps with maintaining established pastures.   Great to use when preparing soil for planting. ",17,0,0,7.7,7.5,9.4
-                    15-potash-sulphur-super,"A blend of Superphosphate, Sulphur Super 30 and Potassium Chloride that helps support plant growth. Best suited for use on established pastures for maintaining the soil.    Contains soluble phosphate, potassium, calcium, and sulfur to support plant growth. ",15.3,0,0,6.8,7.5,17.5
-                    30-potash-super,"Potash Super is a blend of Superphosphate and Potassium Chloride that helps support plant growth. It’s usually applied to land before sowing with seed or to established pastures for maintaining.    Is a good source of phosphorus, sulfur, and potassium to support plant growth.   Select the right product for your situation from the wide range of Potash Supers.   Helps with maintaining established pastures.   Great to use when preparing soil for planting. ",14,0,0,6.3,15,7.7
-                    ravensdown-dicalcic-phosphate®,"Ravensdown Dicalcic Phosphate is a manufactured fertiliser, containing plant-available phosphorus, sulphur and agricultural Ag Lime for optimum pasture growth. It is only available in the North Island.    Extends pasture growth.   Ideal for regular maintenance or developing new land. ",28.6,0,0,4.1,0,5.1
-                    potassium-chloride-granular-1,"A high content potassium fertiliser that readily dissolves for ease of use.    Ideal for Pastoral uses, not recommended on chloride sensitive crops.   Mixes well with all other fertilisers for targeted applications.   Should be used in potassium deficient soils and post-harvest of supplements (Hay/Silage). ",0,0,0,0,50,0
-                    sulphate-of-potash-granular-1,"Used in fertilisers, Sulphate of Potash – Granular supports plant growth, disease resistance and water preservation. The essential sulphur content is derived naturally from plants.    It’s virtually chloride free and has a low salt index making it ideal for use on crops that are sensitive to these two compounds.   The low salt index supports water preservation by plants.   Mixes well with all other fertilisers for ease of targeted application. ",0,0,0,0,41.5,18
-                    serpentine-super-drilling-super,"Serpentine, also known as drilling Super, is a reliable all-around fertiliser. It gives your crops an instant boost of phosphate, sulphur, and will not cause germination injury to seed when applied at recommended rates.    Designed for pastoral agriculture, with better handling and mixing properties.   Used in forage cropping and vegetable production.   Safe for germinating seeds when applied at recommended rates. ",15,5.5,0,6.7,0,8.6
-                    flexi-n-south-island-1,"Tailored for South Island weather and soil conditions, Flexi-N can be mixed with Superphosphate. Prompt spread is recommended.     One application does the trick.   Ability to apply N, P, K, and S.   Suitable for aerial or ground spreading. ",0,2.4,43.2,0,0,0
-                    ammo-36-pro-1,"Great for areas with low sulphate and lots of rain, and boosts nitrogen and sulphate levels ready for spring. Ammo 36 Pro contains N-Protect that helps urea work better, saving nitrogen loss.    Great for use in late winter/early spring, to enhance dairy pasture growth.   Keeps nitrogen where plants need it most – the roots.   Research indicates it can reduce nitrogen loss (through volatilisation) by 50%.   Less ammonia gas lost, so is better for the environment. ",0,0,35.5,0,0,9.2
-                    calcium-ammonium-nitrate-can-1,"Nearly pH-neutral, ideal for perennial fruit crops where mixing lime into the soil is tricky. Combines fast-acting nitrate-nitrogen with longer-lasting ammonium-nitrogen.     Can be used on soils that have a low pH (without lowering further).   Suitable to use in all seasons.   Includes ammonium nitrate, classified as safe and non-flammable. ",5.3,2.4,27,0,0,0
-                    moly-sulphur-super-30-200g-mo-1,"Sulphur Super 30 contains both sulphate and elemental sulphur, providing immediate available sulphur as well as slower availability. Used in a maintenance role where topdressings are infrequent.     Has both quick acting Sulphate-S & medium-term release Elemental-S.   Used in a capital role where the requirement for S is much higher than for P.   The particles of elemental sulphur within the granule will oxidise in soil over approximately 12-24 months.   Blend contains maintenance rates of molybdenum. ",16,0,0,7,0,30.1
-                    ammo-31-pro-1,"Perfect for low-sulphate, high-rainfall areas, boosting nitrogen and sulphate to get ready for spring growth. Ammo 31 Pro contains N-Protect that helps urea work better, saving nitrogen loss.    Great for use in late winter/early spring, to enhance pasture growth.   Keeps nitrogen where plants need it most – the roots.   Research indicates it can reduce nitrogen loss (through volatilisation) by 50%.   Less ammonia gas lost, so it is better for the environment. ",0,0,30.3,0,0,13.8
-                    triple-super-2,"Triple Super is a Superphosphate product that doesn’t contain sulphur. It is a manufactured fertiliser, containing plant-available phosphorus for optimum pasture growth.    Suitable for crops that need phosphate but not sulphur.   It's high solubility makes it easier for spreading.   The high phosphate concentration means that it’s cost competitive when it comes to spreading and easier to transport. ",16,0,0,20.5,0,1
-                    ammo-36™-1,"Crafted for farms for use in late winter and early spring, when sulphate is low and rainfall is high.    Includes the essential mix of nitrogen and sulphate, ready for spring.   Blend of ammonium sulphate and Urea at a ratio of 40:60. ",0,0,35.6,0,0,9.2
-                    ammo-31™-1,"Perfect for boosting pasture in late winter and early spring, with low soil sulphate and high rainfall.     Enhances nitrogen and sulphate levels ready for spring growth.   Perfect blend of ammonium sulphate and Urea at a ratio of 60:40. ",0,0,30.4,0,0,13.8
-                    urea-1,"Cost effective nitrogen source. Nitrogen is the most important nutrient for plant growth. Suitable for all agriculture, horticulture and forestry farming systems.    Highest quick release nitrogen (N) content of any solid fertiliser in NZ.   Increase your dry matter production to meet animal feed needs, like hay or silage. ",0,0,46,0,0,0
-                    granular-ammonium-sulphate-1,"A well-balanced mix of nitrogen and sulphur your plants will love, and handy in the short term when soil needs extra sulphur.    Gives plants and soil the perfect balance of nitrogen and sulphur they need to thrive.   Helps fix short-term sulphur shortages in both crops and pastures.   The safest nitrogen product to mix with fertilisers that don't have superphosphate in them. ",0,0,20,0,0,23
-                    n-protect®,"N-Protect is designed to slow down the release of ammonia, keeping more nitrogen for your plants rather than losing it into the air. By doing so, you're not only improving your crops but also reducing your environmental footprint—a win-win.    Coated urea reduces nitrogen losses, saving money in the long run.   Your plants can make the most of extra nitrogen in their roots.   Research shows that using the urease inhibitor coating can cut nitrogen loss by 50%, making your farm more eco-friendly. ",0,0,45.9,0,0,0
-                    superphosphate-1,Superphosphate is a manufactured fertiliser containing plant-available phosphorus and sulphur for optimum pasture growth    Cost-effective fertiliser to extend pasture growth.   Perfect for regular maintenance or developing new land. ,20,0,0,9,0,11
-                    avocado-regular-mix-te-1,"Designed to provide all the nutritional requirements for an avocado tree in one mix. The potassium in the mix is exclusively Potassium Sulphate, making it safe for avocado trees, which are sensitive to chloride.
-                      Provides all the nutrients (NPKS + TE) an avocado tree requires in one mix. Contains only Potassium Sulphate so it&rsquo;s great for use on chloride sensitive crops. Contains enough Boron and Zinc to meet plant demands. ",3,2.7,9.6,4.2,18.7,9.9
-                    dolomite,"Ideal in dairy and horticultural systems. Dolomite is a naturally occurring source of both magnesium and calcium carbonate.
-                        Combined source of magnesium and lime   Magnesium content in a readily available form due to the particle size of the product ",23,11,0,0,0,0
-                    lawn-fertiliser-1,"Crafted to give you lush green grass by balancing nitrogen and phosphorus, plus a touch of iron sulphate to keep moss at bay.
-                      Nitrogen applied in the form of Ammonium Sulphate helps to lower the soil pH, discouraging earthworms. This product can even add vibrancy to grass colour. ",5,0,14.5,2.3,0,19.7
-                    garden-fertiliser-1,"Adding this balance blend of garden fertiliser offers your soil a healthy boost of essential nutrients.
-                      When your soil is in good shape and has the right nutrients, your plants can grow, produce, and flourish the way they should. A balanced blend of Superphosphate, Potassium Sulphate, Ammonium Sulphate, and Magnesium Oxide with the addition of a small amount of Sodium Molybdate and Sodium Borate. ",9.4,1,6.6,4.3,7.1,15.8"""
-                },
-                {
-                    "role": "user",
-                    "content": f"Based on this soil analysis summary and the list of products that you have, provide detailed fertilizer recommendations:\n\n{summary}"
-                }
-            ]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error generating recommendations: {traceback.format_exc()}"
+        with metrics.stage("process_pdf") as span:
+            with metrics.stage("hash_upload", bytes=size):
+                pdf_hash = await asyncio.to_thread(hash_file, pdf_path)
+            report_key = cache_key("report", pdf_hash, EXTRACTION_VERSION)
+            extracted = await get_cache().aget(report_key)
+            span.set(cached_extraction=extracted is not None)
+
+            if extracted is None:
+                try:
+                    # Extraction is CPU bound, keep it off the event loop
+                    extracted = await asyncio.to_thread(extract_report, pdf_path)
+                except Exception as e:
+                    span.set(status="error")
+                    _discard(pdf_path)
+                    yield _hidden_outputs(f"Error extracting text from PDF: {str(e)}")
+                    return
+                await get_cache().aset(report_key, extracted)
+
+            with metrics.stage("parse") as parse_span:
+                samples = parse_analyte_tables(extracted["tables"])
+                detected_farm, detected_date = detect_report_metadata(extracted["content"])
+                report = Report(pdf_hash, samples, build_report_index(extracted),
+                                farm=(farm or "").strip() or detected_farm,
+                                sampled_on=parse_date(sampled_on) or detected_date)
+                parse_span.set(samples=len(samples.index), passages=len(report.index))
+
+            summary_key = cache_key("summary", pdf_hash, MODEL, SUMMARY_PROMPT_VERSION, REFERENCE_RANGES_HASH)
+            summary = await get_cache().aget(summary_key)
+            span.set(cached_summary=summary is not None)
+
+            if summary is None:
+                # Known analytes are checked against the reference ranges locally, only the flags go to the model
+                if samples.empty:
+                    summaries = stream_summarize_soil_report(extracted["content"])
+                else:
+                    summaries = stream_summarize_flagged_values(flagged_values(samples))
+
+                async for summary in summaries:
+                    yield _hidden_outputs(summary)
+
+                if summary.startswith("Error"):
+                    span.set(status="error")
+                    return
+                # Only the complete summary is cached, a cancelled stream never gets here
+                await get_cache().aset(summary_key, summary)
+
+            report.summary = summary
+            if report.farm:
+                with metrics.stage("store_report"):
+                    await asyncio.to_thread(get_store().add_report, pdf_hash, report.farm, report.sampled_on, samples,
+                                            summary=summary, source=os.path.basename(pdf_path))
+
+            # Make query box, buttons, and output boxes visible
+            yield (summary,
+                   _visible(True),  # Query box
+                   _visible(True),  # Ask Question button
+                   _visible(True),  # Get Recommendations button
+                   None,  # Clear query output
+                   None,  # Clear recommendations output
+                   report)  # Session report
 
+    except Exception as e:
+        error_msg = f"Error in processing: {traceback.format_exc()}"
+        yield _hidden_outputs(error_msg)
 
-class State:
-    def __init__(self):
-        self.summary = None
 
+async def process_query(query, report):
+    """
+    Process user's query about the soil report, streaming the answer.
 
-state = State()
+    Simple value lookups are answered from the parsed report without calling
+    the model, and repeated questions come from the report's answer cache.
+    Questions about earlier reports, spotted by explicit phrases such as
+    "trend", "over time" or "since last year", get the farm's stored results.
+    Plain requests like "pH trend in paddock 3" are answered with those alone,
+    questions that need reasoning go to the model with them.
 
+    Args:
+        query (str): User's specific question
+        report (Report): Report held in the session state
 
-def process_pdf(pdf_file):
+    Yields:
+        str: Answer to the query
+    """
+    if report is None:
+        yield "Please upload a soil report first."
+        return
+
+    history, plain = await asyncio.to_thread(history_lookup, get_store(), report.farm, query)
+    if history is not None:
+        if plain:
+            yield history
+            return
+        # Stored results change as reports are added, so the answer is keyed by them and not kept in the session
+        key = cache_key("answer", report.pdf_hash, hash_text(report.summary), hash_text(history), MODEL,
+                        QUERY_PROMPT_VERSION, normalize_query(query))
+        answer = await get_cache().aget(key)
+        if answer is not None:
+            yield answer
+            return
+        passages = report.index.search(query, k=QUERY_PASSAGES)
+        async for answer in stream_answer_query(report.summary, query, passages, history):
+            yield answer
+        if not answer.startswith("Error"):
+            await get_cache().aset(key, answer)
+        return
+
+    normalized = normalize_query(query)
+    if normalized in report.answers:
+        yield report.answers[normalized]
+        return
+
+    key = cache_key("answer", report.pdf_hash, hash_text(report.summary), MODEL, QUERY_PROMPT_VERSION, normalized)
+    answer = await get_cache().aget(key)
+    if answer is None:
+        answer = lookup_answer(query, report.samples, REFERENCE_RANGES)
+
+    if answer is not None:
+        report.answers[normalized] = answer
+        yield answer
+        return
+
+    passages = report.index.search(query, k=QUERY_PASSAGES)
+    async for answer in stream_answer_query(report.summary, query, passages):
+        yield answer
+
+    if normalized and not answer.startswith("Error"):
+        report.answers[normalized] = answer
+        await get_cache().aset(key, answer)
+
+
+async def process_recommendations(report):
     """
-    Process the uploaded PDF file.
+    Generate fertilizer recommendations, streaming them as they arrive.
 
     Args:
-        pdf_file (bytes): Uploaded PDF file
+        report (Report): Report held in the session state
 
-    Returns:
-        Tuple of outputs for Gradio interface
+    Yields:
+        str: Fertilizer recommendations
     """
-    if pdf_file is None:
-        return "Please upload a PDF file.", gr.update(visible=False), gr.update(visible=False), gr.update(
-            visible=False), None, None
+    if report is None:
+        yield "Please upload a soil report first."
+        return
 
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            temp_pdf.write(pdf_file)
-            temp_pdf_path = temp_pdf.name
-
-        content = extract_text_and_tables_from_pdf(temp_pdf_path)
-        if content.startswith("Error"):
-            return content, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), None, None
-
-        summary = summarize_soil_report(content)
-        state.summary = summary
-
-        try:
-            os.unlink(temp_pdf_path)
-        except:
-            pass
-
-        # Make query box, buttons, and output boxes visible
-        return (summary,
-                gr.update(visible=True),  # Query box
-                gr.update(visible=True),  # Ask Question button
-                gr.update(visible=True),  # Get Recommendations button
-                None,  # Clear query output
-                None)  # Clear recommendations output
+    # Products and rates come from the optimizer when the report's values were parsed, run off the event loop
+    plan = await asyncio.to_thread(fertilizer_plan, report.samples)
+    plan = plan.format() if plan is not None else None
 
-    except Exception as e:
-        error_msg = f"Error in processing: {traceback.format_exc()}"
-        return error_msg, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), None, None
+    key = cache_key("recommendations", hash_text(report.summary), hash_text(plan or ""), MODEL,
+                    RECOMMENDATION_PROMPT_VERSION)
+    recommendations = await get_cache().aget(key)
+    if recommendations is not None:
+        yield recommendations
+        return
 
+    async for recommendations in stream_fertilizer_recommendations(report.summary, plan):
+        yield recommendations
 
-def process_query(query):
+    if not recommendations.startswith("Error"):
+        await get_cache().aset(key, recommendations)
+        if report.farm:
+            await asyncio.to_thread(get_store().set_recommendations, report.pdf_hash, recommendations)
+
+
+def process_history(farm, analyte, paddock):
     """
-    Process user's query about the soil report.
+    Show an analyte's stored values over time, or the latest change of every analyte.
 
     Args:
-        query (str): User's specific question
+        farm (str): Farm name
+        analyte (str): Analyte key, every analyte when empty
+        paddock (str): Paddock name, every paddock when empty
 
     Returns:
-        str: Answer to the query
+        str: One line per paddock and analyte
     """
-    if state.summary is None:
-        return "Please upload a soil report first."
-    return answer_query(state.summary, query)
+    farm = (farm or "").strip()
+    if not farm:
+        return "Please enter the farm name."
+    paddock = (paddock or "").strip() or None
 
+    store = get_store()
+    if analyte:
+        text = format_trend(store.trend(farm, analyte, paddock), analyte)
+    else:
+        text = format_comparison(store.compare(farm, paddock=paddock))
+    return text or f"No stored results for {farm}."
 
-def process_recommendations():
+
+def create_app():
     """
-    Generate fertilizer recommendations.
+    Build the Gradio interface.
 
     Returns:
-        str: Fertilizer recommendations
+        gr.Blocks: The app, with its queue configured
     """
-    if state.summary is None:
-        return "Please upload a soil report first."
-    return get_fertilizer_recommendations(state.summary)
-
-
-# Create Gradio interface
-with gr.Blocks(theme=gr.themes.Soft()) as gui:
-    gr.Markdown("# Soil Report Analyzer")
-    gr.Markdown(
-        "Upload a soil report PDF to get an instant comprehensive analysis, then ask questions or get fertilizer recommendations.")
-
-    with gr.Row():
-        with gr.Column(scale=1):
-            file_input = gr.File(
-                label="Upload Soil Report PDF",
-                type="binary",
-                file_types=[".pdf"]
-            )
-
-            # Query section
-            with gr.Group(visible=False) as query_group:
-                query_input = gr.Textbox(
-                    label="Ask a question about the soil report",
-                    placeholder="Example: What is the pH level in sample 1?",
+    import gradio as gr
+
+    with gr.Blocks(theme=gr.themes.Soft(), delete_cache=(UPLOAD_TTL_SECONDS, UPLOAD_TTL_SECONDS)) as gui:
+        gr.Markdown("# Soil Report Analyzer")
+        gr.Markdown(
+            "Upload a soil report PDF to get an instant comprehensive analysis, then ask questions or get fertilizer recommendations.")
+
+        # Report uploaded in this browser session
+        report_state = gr.State(None)
+
+        with gr.Row():
+            with gr.Column(scale=1):
+                file_input = gr.File(
+                    label="Upload Soil Report PDF",
+                    type="filepath",
+                    file_types=[".pdf"]
+                )
+                with gr.Row():
+                    farm_input = gr.Textbox(label="Farm", placeholder="Read from the report when empty")
+                    date_input = gr.Textbox(label="Sampling date", placeholder="YYYY-MM-DD, read from the report when empty")
+
+                # Query section
+                with gr.Group(visible=False) as query_group:
+                    query_input = gr.Textbox(
+                        label="Ask a question about the soil report",
+                        placeholder="Example: What is the pH level in sample 1?",
+                    )
+                    ask_button = gr.Button("Ask Question", variant="primary")
+
+                # Recommendations button
+                get_recommendations_button = gr.Button(
+                    "Get Fertilizer Recommendations",
+                    visible=False,
+                    variant="secondary"
+                )
+
+            with gr.Column(scale=2):
+                # Output boxes
+                summary_output = gr.Textbox(
+                    label="Soil Report Analysis",
+                    lines=12,
+                    placeholder="Your soil report analysis will appear here..."
+                )
+
+                query_output = gr.Textbox(
+                    label="Answer",
+                    lines=4,
+                    placeholder="Your answer will appear here..."
                 )
-                ask_button = gr.Button("Ask Question", variant="primary")
-
-            # Recommendations button
-            get_recommendations_button = gr.Button(
-                "Get Fertilizer Recommendations",
-                visible=False,
-                variant="secondary"
-            )
-
-        with gr.Column(scale=2):
-            # Output boxes
-            summary_output = gr.Textbox(
-                label="Soil Report Analysis",
-                lines=12,
-                placeholder="Your soil report analysis will appear here..."
-            )
-
-            query_output = gr.Textbox(
-                label="Answer",
-                lines=4,
-                placeholder="Your answer will appear here..."
-            )
-
-            recommendations_output = gr.Textbox(
-                label="Fertilizer Recommendations",
-                lines=8,
-                placeholder="Fertilizer recommendations will appear here..."
-            )
-
-    # Event handlers
-    file_input.upload(
-        process_pdf,
-        inputs=[file_input],
-        outputs=[
-            summary_output,
-            query_group,
-            ask_button,
-            get_recommendations_button,
-            query_output,
-            recommendations_output
-        ]
-    )
-
-    # Handle query submission
-    ask_button.click(
-        process_query,
-        inputs=[query_input],
-        outputs=[query_output]
-    )
-
-    # Also allow Enter key to submit query
-    query_input.submit(
-        process_query,
-        inputs=[query_input],
-        outputs=[query_output]
-    )
-
-    # Handle recommendations request
-    get_recommendations_button.click(
-        process_recommendations,
-        inputs=[],
-        outputs=[recommendations_output]
-    )
+
+                recommendations_output = gr.Textbox(
+                    label="Fertilizer Recommendations",
+                    lines=8,
+                    placeholder="Fertilizer recommendations will appear here..."
+                )
+
+        # History of the farm's stored reports
+        with gr.Accordion("Report History", open=False):
+            with gr.Row():
+                history_analyte = gr.Dropdown(
+                    label="Analyte",
+                    choices=[("Latest change of every analyte", "")] +
+                            [(f"{name} ({unit})", key) for key, (name, unit) in ANALYTES.items()],
+                    value=""
+                )
+                history_paddock = gr.Textbox(label="Paddock", placeholder="Every paddock when empty")
+                history_button = gr.Button("Show History")
+            history_output = gr.Textbox(label="History", lines=8)
+
+        # Event handlers
+        upload_event = file_input.upload(
+            process_pdf,
+            inputs=[file_input, farm_input, date_input],
+            outputs=[
+                summary_output,
+                query_group,
+                ask_button,
+                get_recommendations_button,
+                query_output,
+                recommendations_output,
+                report_state
+            ],
+            # Extraction is CPU bound, so uploads get a tighter limit than the other events
+            concurrency_limit=UPLOAD_CONCURRENCY
+        )
+
+        # Removing the file cancels a summary that is still streaming
+        file_input.clear(None, None, None, cancels=[upload_event])
+
+        # Handle query submission
+        ask_button.click(
+            process_query,
+            inputs=[query_input, report_state],
+            outputs=[query_output]
+        )
+
+        # Also allow Enter key to submit query
+        query_input.submit(
+            process_query,
+            inputs=[query_input, report_state],
+            outputs=[query_output]
+        )
+
+        # Handle recommendations request
+        get_recommendations_button.click(
+            process_recommendations,
+            inputs=[report_state],
+            outputs=[recommendations_output]
+        )
+
+        history_button.click(
+            process_history,
+            inputs=[farm_input, history_analyte, history_paddock],
+            outputs=[history_output]
+        )
+
+    gui.queue(default_concurrency_limit=QUEUE_CONCURRENCY, max_size=QUEUE_MAX_SIZE)
+    return gui
+
 
 if __name__ == "__main__":
-    gui.launch(share=True)
\ No newline at end of file
+    metrics.start()
+    print(f"Imported in {IMPORT_SECONDS:.2f}s")
+    if WARM_UP:
+        print(f"Warmed up in {warm_up():.2f}s")
+    create_app().launch(share=True, max_file_size=f"{MAX_UPLOAD_MB}mb")
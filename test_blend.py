@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from blend import COLUMNS, plan_blends
+from catalog import NUTRIENTS, get_catalog
+
+RANGES = {"ph": (5.8, 6.3), "olsen_p": (20, 30), "qt_k": (5, 8), "qt_mg": (8, 10), "sulphate_s": (10, 12)}
+
+# Acidic and short of everything, tonnes of lime next to a few kg of sulphur
+DEFICIENT = pd.DataFrame({"ph": [5.3], "olsen_p": [12.0], "qt_k": [3.0], "qt_mg": [5.0], "sulphate_s": [5.0]},
+                         index=["1"])
+
+
+@pytest.mark.parametrize("max_products,share", [(4, 0.7), (6, 0.9)])
+def test_every_target_is_mostly_supplied(max_products, share):
+    plan = plan_blends(DEFICIENT, RANGES, max_products=max_products)
+    needed = plan.targets > 0
+    assert needed.sum() == 5
+    assert (plan.supplied[needed] >= share * plan.targets[needed]).all()
+    assert ((plan.rates > 0).sum(axis=1) <= max_products).all()
+
+
+def test_small_target_survives_the_product_limit():
+    plan = plan_blends(DEFICIENT, RANGES, max_products=4)
+    sulphur = COLUMNS.index("S")
+    assert plan.supplied[0, sulphur] >= 0.9 * plan.targets[0, sulphur]
+
+
+def test_sample_in_range_gets_nothing():
+    samples = pd.DataFrame({"ph": [6.0, 5.3], "olsen_p": [25.0, 12.0]}, index=["1", "2"])
+    plan = plan_blends(samples, RANGES)
+    assert not plan.rates[0].any()
+    assert plan.rates[1].any()
+
+
+def test_products_rich_in_an_excess_nutrient_are_avoided():
+    samples = pd.DataFrame({"olsen_p": [12.0], "sulphate_s": [20.0]}, index=["1"])
+    plan = plan_blends(samples, RANGES)
+    sulphur = get_catalog().matrix[:, NUTRIENTS.index("S")]
+    assert plan.rates[0].any()
+    assert (sulphur[plan.rates[0] > 0] <= 1.0).all()
+    assert plan.supplied[0, COLUMNS.index("P")] >= 0.8 * plan.targets[0, COLUMNS.index("P")]
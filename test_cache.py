@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from cache import ResultCache, cache_key
+
+
+def test_keys_depend_on_every_part():
+    assert cache_key("summary", "abc", 3) == cache_key("summary", "abc", "3")
+    assert cache_key("summary", "abc", 3) != cache_key("summary", "abc", 4)
+    assert cache_key("ab", "c") != cache_key("a", "bc")
+
+
+def test_results_survive_a_new_cache(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.set("key", {"content": "pH 5.4"})
+    assert cache.get("key") == {"content": "pH 5.4"}
+    reopened = ResultCache(str(tmp_path))
+    assert reopened.get("key") == {"content": "pH 5.4"}
+    assert reopened.get("other") is None
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_memory_is_bounded_by_size(tmp_path):
+    entry = "x" * 100
+    cache = ResultCache(str(tmp_path), max_memory_bytes=3 * len(json.dumps(entry)))
+    for index in range(5):
+        cache.set(str(index), entry)
+    assert cache.stats()["memory_entries"] == 3
+    # Evicted from memory, still on disk
+    assert cache.get("0") == entry
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    entry = "x" * 100
+    size = len(json.dumps(entry))
+    cache = ResultCache(str(tmp_path), max_memory_entries=0, max_disk_bytes=3 * size)
+    for index in range(3):
+        cache.set(str(index), entry)
+    cache.get("0")
+    cache.set("3", entry)
+    assert cache.get("1") is None
+    assert cache.get("0") == entry
+    assert cache.stats()["disk_bytes"] == 3 * size
+    reopened = ResultCache(str(tmp_path), max_disk_bytes=3 * size)
+    assert reopened.stats()["disk_entries"] == 3
+
+
+def test_async_api(tmp_path):
+    async def roundtrip():
+        cache = ResultCache(str(tmp_path))
+        await cache.aset("key", ["a", 1])
+        return await cache.aget("key"), await cache.aget("missing")
+
+    assert asyncio.run(roundtrip()) == (["a", 1], None)
+
+
+def test_unserializable_values_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.set("key", object())
+    assert cache.get("key") is None
+    assert cache.stats()["disk_entries"] == 0
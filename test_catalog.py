@@ -0,0 +1,45 @@
+import pytest
+
+from catalog import detect_nutrient_status
+
+# Summaries as the model writes them, with the nutrients they flag as (deficient, excess)
+SUMMARIES = [
+    (
+        "Magnesium levels are adequate but potassium is low.",
+        ({"K"}, set()),
+    ),
+    (
+        "Sample 1 has high calcium and low phosphorus.",
+        ({"P"}, {"Ca"}),
+    ),
+    (
+        "Overall, the soil is moderately acidic with a pH of 5.4, which is below the optimal range of 5.8-6.3 "
+        "for pasture. Olsen Phosphorus is low at 14 mg/L, so phosphate inputs are needed to lift production. "
+        "Potassium (QT 6) and magnesium (QT 9) are within the medium ranges. Sulphate sulphur is elevated at "
+        "18 mg/kg, so additional sulphur is not required.",
+        ({"pH", "P"}, {"S"}),
+    ),
+    (
+        "Key findings:\n"
+        "- Calcium, magnesium and potassium are all deficient across Samples 1-3.\n"
+        "- Sodium is high in Sample 2, while phosphorus is satisfactory.\n"
+        "- Organic matter is good at 9.8%.",
+        ({"Ca", "Mg", "K"}, set()),
+    ),
+    (
+        "The Olsen P of 42 mg/L is well above the target range; potassium is adequate, but magnesium is "
+        "deficient at QT 5. Nitrogen supply (AMN 120 kg/ha) is in the normal range.",
+        ({"Mg"}, {"P"}),
+    ),
+]
+
+
+@pytest.mark.parametrize("summary,expected", SUMMARIES)
+def test_detect_nutrient_status(summary, expected):
+    assert detect_nutrient_status(summary) == expected
+
+
+def test_nutrient_reported_both_ways_is_deficient():
+    deficient, excess = detect_nutrient_status("Potassium is high in Sample 1. Sample 2 has low potassium.")
+    assert deficient == {"K"}
+    assert excess == set()
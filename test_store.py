@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from store import ReportStore, history_lookup
+
+FARM = "Hill Farm"
+
+
+@pytest.fixture
+def store():
+    store = ReportStore(":memory:")
+    for sha256, sampled_on, ph, olsen_p in (("a", "2022-03-01", 5.4, 14.0), ("b", "2023-03-01", 5.9, 18.0)):
+        samples = pd.DataFrame({"ph": [ph, 6.1], "olsen_p": [olsen_p, None]}, index=["Paddock 3", "Paddock A"])
+        store.add_report(sha256, FARM, sampled_on, samples)
+    yield store
+    store.close()
+
+
+def test_adding_a_report_again_replaces_its_values(store):
+    samples = pd.DataFrame({"ph": [6.0]}, index=["Paddock 3"])
+    store.add_report("b", FARM, "2023-03-01", samples)
+    assert [(sampled_on, value) for sampled_on, _, value, _ in store.trend(FARM, "ph", "Paddock 3")] == [
+        ("2022-03-01", 5.4), ("2023-03-01", 6.0)]
+    assert [(sampled_on, value) for sampled_on, _, value, _ in store.trend(FARM, "ph", "Paddock A")] == [
+        ("2022-03-01", 6.1)]
+
+
+def test_compare_latest_with_previous(store):
+    (entry,) = store.compare(FARM, "olsen_p")
+    assert (entry["paddock"], entry["previous"], entry["latest"]) == ("Paddock 3", 14.0, 18.0)
+
+
+# Questions with whether they are about history and whether the stored values answer them alone
+QUERIES = [
+    ("pH trend in paddock 3", True, True),
+    ("What is the pH trend in paddock 3?", True, True),
+    ("What was the pH last year?", True, True),
+    ("Compare Olsen P with the previous report", True, True),
+    ("Why has the pH dropped since last year?", True, False),
+    ("How has the pH changed over time?", True, False),
+    ("What is the pH of sample 1?", False, False),
+    ("How can I change the pH in Paddock A?", False, False),
+]
+
+
+@pytest.mark.parametrize("query,about_history,plain", QUERIES)
+def test_history_lookup_routing(store, query, about_history, plain):
+    history, answered = history_lookup(store, FARM, query)
+    assert (history is not None) == about_history
+    assert answered == plain
+
+
+def test_history_lookup_trend_of_one_paddock(store):
+    history, _ = history_lookup(store, FARM, "pH trend in paddock 3")
+    assert history == "pH in Paddock 3: 2022-03-01: 5.4 pH units, 2023-03-01: 5.9 pH units"
+
+
+def test_history_lookup_unknown_farm(store):
+    history, _ = history_lookup(store, "Other Farm", "pH trend in paddock 3")
+    assert history is None